@@ -1,188 +1,473 @@
 import asyncio
+import hashlib
 import json
 import os
+import time
 
 import requests
 import stripe
-from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from clients import get_supabase, load_env
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
-from image_to_listing import image_to_listing
-from image_to_listing_v2 import image_to_listing as image_to_listing_v2
-from openai import OpenAI
-from pydantic import BaseModel
-from supabase import create_client
-from supabase_functions import insert_to_supabase
-from qr_generator import generate_qr_code  # Assuming you have a module for QR code generation
+from get_price_search import get_price_search
+from image_store import get_image_store
+from jobs import JobManager, QueueFullError
+from listing_pipeline import (
+    ListingPipelineError,
+    analyze_products,
+    create_listing,
+    create_listing_from_analysis,
+    create_listings,
+    get_bulk_max_items,
+)
+from uploads import UploadError, get_max_bulk_upload_bytes, get_max_upload_bytes, read_image_upload, read_image_uploads
+from supabase_functions import get_change_feed, get_table_cache, iter_pages, on_change, select_page, select_rows
+from listing_features import LISTING_COLUMNS, LISTING_FEATURE_COLUMNS, LISTING_LIST_COLUMNS
+from metrics import (
+    count,
+    end_request_timings,
+    observe,
+    register_collector,
+    render as render_metrics,
+    request_timings,
+    server_timing,
+    span,
+    start_request_timings,
+)
+from openai_scheduler import get_scheduler
+from matches import (
+    get_push_watermark,
+    save_matches,
+    select_changed,
+    set_push_watermark,
+    top_matches_for_buyer,
+    utc_now,
+)
+from qrcode.exceptions import DataOverflowError
+from qr_generator import FORMATS as QR_FORMATS, MAX_DATA_BYTES as QR_MAX_DATA_BYTES, render_qr_code
+from realtime_keys import (
+    DEFAULT_MODEL as DEFAULT_REALTIME_MODEL,
+    DEFAULT_VOICE as DEFAULT_REALTIME_VOICE,
+    get_allowed_models as get_allowed_realtime_models,
+    get_allowed_voices as get_allowed_realtime_voices,
+    get_realtime_keys,
+)
+from relevance import score_all
+from score_cache import get_score_cache
+from search_index import get_search_index, get_search_page_size, get_search_rebuild_interval, update_search_index
+from stripe_prices import price_index
+from vector_index import candidate_pairs, on_listings_change, on_users_change
+from vision_cache import get_vision_cache
+
+
+def server_timing_enabled() -> bool:
+    return os.environ.get("SERVER_TIMING", "false").lower() in ("1", "true")
+
+
+def collect_stats(jobs, realtime_keys) -> dict:
+    """Gauges for /metrics from the stats the scheduler, caches, key pool and job manager keep"""
+    scheduler = get_scheduler().stats()
+    gauges = {
+        "openai_scheduler_queue_depth": scheduler["queue_depth"],
+        "openai_scheduler_requests_available": scheduler["requests_available"],
+        "openai_scheduler_tokens_available": scheduler["tokens_available"],
+        "jobs_pending": jobs.stats()["pending"],
+        "stripe_price_index_lookups": {
+            (("result", "hit"),): price_index.hits,
+            (("result", "miss"),): price_index.misses,
+        },
+    }
+    for name in ("calls", "retries", "errors", "wait_seconds", "max_wait_seconds", "queued"):
+        gauges[f"openai_scheduler_{name}"] = {
+            (("priority", priority),): metrics[name]
+            for priority, metrics in scheduler["priorities"].items()
+        }
+    for cache, stats in (
+        ("vision", get_vision_cache().stats()),
+        ("score", get_score_cache().stats()),
+        ("price_search", get_price_search().stats()),
+        ("supabase", get_table_cache().stats()),
+    ):
+        for name, value in stats.items():
+            gauges.setdefault(f"cache_{name}", {})[(("cache", cache),)] = value
+    for name, value in realtime_keys.stats().items():
+        gauges[f"realtime_key_pool_{name}"] = value
+    for name, value in get_search_index().stats().items():
+        gauges[f"search_index_{name}"] = value
+    return gauges
 
 
-class RelevanceScore(BaseModel):
-    relevance_score: int
+def create_app():
+    app = Flask(__name__)
 
+    # Load environment variables
+    load_env()
 
-class RelevanceScoreWithUser(RelevanceScore):
-    user_id: int
-    username: str
+    # Reject oversized uploads before reading them
+    app.config["MAX_CONTENT_LENGTH"] = get_max_upload_bytes()
 
+    # Initialize Stripe client
+    stripe.api_key = os.environ.get("STRIPE_API_KEY")
 
-async def get_relevance_score(listing, buyer) -> RelevanceScoreWithUser:
-    openai = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-    task = openai.beta.chat.completions.parse(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a recommendation system that rates how relevant items are to users based on their preferences. Return a relevance score from 1-10, where 1 is least relevant and 10 is most relevant.",
-            },
-            {
-                "role": "user",
-                "content": f"Rate how relevant this listing is to the user's preferences:\nListing: {listing}\nUser preferences: {buyer}",
-            },
-        ],
-        response_format=RelevanceScore,
-    )
-    result = task.choices[0].message.parsed
-    formatted_result = RelevanceScoreWithUser(
-        relevance_score=result.relevance_score,
-        user_id=buyer.get("id"),
-        username=buyer.get("username"),
-    )
-    return formatted_result
+    # Load existing prices so repeated price changes skip Stripe
+    if stripe.api_key and os.environ.get("STRIPE_WARM_PRICES", "true").lower() in ("1", "true"):
+        price_index.warm_in_background()
 
+    # Search price ranges for common categories ahead of the first listings
+    warm_categories = [c.strip() for c in os.environ.get("PRICE_SEARCH_WARM_CATEGORIES", "").split(",") if c.strip()]
+    if warm_categories:
+        get_price_search().warm_in_background(warm_categories)
 
-def create_app():
-    app = Flask(__name__)
+    # Mint realtime keys ahead of the first voice session
+    realtime_keys = get_realtime_keys()
+    if os.environ.get("OPENAI_API_KEY") and os.environ.get("REALTIME_KEY_PREFETCH", "true").lower() in ("1", "true"):
+        realtime_keys.prefetch()
 
-    # Load environment variables
-    load_dotenv(override=True)
+    # Listing images live in a content-addressed store, not in the listings table
+    image_store = get_image_store()
 
-    # Initialize Supabase client
-    url = os.environ.get("SUPABASE_URL")
-    key = os.environ.get("SUPABASE_KEY")
-    print(f"URL: {url}")
-    print(f"KEY: {key}")
-    supabase = create_client(url, key)
+    # Bounded worker pool for long-running requests
+    jobs = JobManager.from_env()
 
-    # Initialize Stripe client
-    stripe.api_key = os.environ.get("STRIPE_API_KEY")
+    # Drop cached reads on writes made by other workers too
+    get_change_feed()
+
+    # Keep the embedding and search indexes up to date as rows are written
+    on_change("listings", on_listings_change)
+    on_change("users", on_users_change)
+    on_change("listings", update_search_index)
+
+    # Index listing text for /search in one paginated pass, without blocking startup
+    if os.environ.get("SUPABASE_URL") and os.environ.get("SEARCH_INDEX", "true").lower() in ("1", "true"):
+        get_search_index().build_in_background(get_search_page_size())
+        # Without a change feed, other workers' writes only arrive with a rebuild
+        if get_search_rebuild_interval() > 0:
+            get_search_index().rebuild_periodically(get_search_rebuild_interval(), get_search_page_size())
 
     # Enable CORS
     CORS(app)
 
+    # Request counts, latencies and payload sizes for /metrics
+    register_collector(lambda: collect_stats(jobs, realtime_keys))
+
+    @app.before_request
+    def start_timing():
+        g.started = time.perf_counter()
+        g.timings_token = start_request_timings()
+
+    @app.after_request
+    def record_request(response):
+        elapsed = time.perf_counter() - g.started
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        count("http_requests_total", method=request.method, endpoint=endpoint, status=response.status_code)
+        observe("http_request_duration_seconds", elapsed, endpoint=endpoint)
+        if request.content_length:
+            count("http_request_bytes_total", request.content_length, endpoint=endpoint)
+        if not response.is_streamed and response.content_length is not None:
+            count("http_response_bytes_total", response.content_length, endpoint=endpoint)
+        # Opt-in, since it tells clients which upstream calls were made
+        if server_timing_enabled():
+            response.headers["Server-Timing"] = server_timing(request_timings(), elapsed)
+        return response
+
+    @app.teardown_request
+    def end_timing(exc):
+        token = g.pop("timings_token", None)
+        if token is not None:
+            end_request_timings(token)
+
+    # Prometheus scrape endpoint
+    @app.route("/metrics", methods=["GET"])
+    def get_metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
     # Example route (you can also move this to routes.py)
     @app.route("/")
     def home():
         return "Hello, Flask!"
 
-    # Get all listings
+    # Get listings, one page at a time
     @app.route("/listings", methods=["GET"])
     def get_listings():
-        # Get all listings from the database
-        listings = supabase.table("listings").select("*").execute()
-        return listings.data
+        limit = max(1, min(request.args.get("limit", default=50, type=int), 500))
+        cursor = request.args.get("cursor", type=int)
+
+        # Image data is only returned when asked for explicitly
+        fields = request.args.get("fields")
+        if fields:
+            columns = [field.strip() for field in fields.split(",") if field.strip()]
+            unknown = [column for column in columns if column not in LISTING_COLUMNS]
+            if unknown:
+                return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+            if "id" not in columns:
+                columns.insert(0, "id")
+            columns = ", ".join(columns)
+        else:
+            columns = LISTING_LIST_COLUMNS
+
+        # Stream every listing (after cursor, to resume) as NDJSON while pages arrive from Supabase
+        if request.args.get("format") == "ndjson" or request.accept_mimetypes.best == "application/x-ndjson":
+
+            def generate():
+                for page in iter_pages("listings", columns, page_size=limit, after=cursor):
+                    for listing in page:
+                        yield json.dumps(listing) + "\n"
+
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+        listings = select_page("listings", columns, limit, after=cursor)
+        next_cursor = listings[-1]["id"] if len(listings) == limit else None
+        body = json.dumps({"data": listings, "next_cursor": next_cursor})
+
+        etag = hashlib.sha256(body.encode("utf-8")).hexdigest()
+        if etag in request.if_none_match:
+            return Response(status=304, headers={"ETag": f'"{etag}"'})
+        return Response(body, mimetype="application/json", headers={"ETag": f'"{etag}"'})
+
+    # Full-text search over listings, optionally within a price range
+    @app.route("/search", methods=["GET"])
+    def search_listings():
+        limit = max(1, min(request.args.get("limit", default=20, type=int), 100))
+        min_price = request.args.get("min_price", type=float)
+        max_price = request.args.get("max_price", type=float)
+        if min_price is not None and max_price is not None and min_price > max_price:
+            return jsonify({"error": "min_price must not be greater than max_price"}), 400
+
+        index = get_search_index()
+        with span("search.query"):
+            result = index.search(request.args.get("q", ""), min_price, max_price, limit)
+        # Results may be incomplete while the index is still being built
+        result["complete"] = index.ready
+        return jsonify(result), 200
 
     # Create listing from image
     @app.route("/create-listing-from-image", methods=["POST"])
     def create_listing_from_image():
-        if not request.is_json:
-            return jsonify({"error": "Request must be JSON"}), 400
-
-        data = request.get_json()
-
-        # Check if base64_image is in the request
-        if "base64_image" not in data:
-            return jsonify({"error": "base64_image is required"}), 400
-
-        base64_image = data["base64_image"]
-
-        # Process image to generate listing details
-        listing_json = image_to_listing(base64_image)
+        # A JSON `analysis_id` from /image-to-products reuses that analysis
+        # instead of uploading and analyzing the image again
+        data = request.get_json(silent=True) if request.is_json else None
+        if isinstance(data, dict) and data.get("analysis_id"):
+            product_index = data.get("product_index", 0)
+            if not isinstance(product_index, int):
+                return jsonify({"error": "product_index must be an integer"}), 400
+            pipeline, args = create_listing_from_analysis, (data["analysis_id"], product_index)
+        else:
+            try:
+                image = read_image_upload(request)
+            except UploadError as e:
+                return jsonify({"error": str(e)}), e.status
+            pipeline, args = create_listing, (image, image_store)
+
+        # Run the pipeline in the background with ?async=true or Prefer: respond-async
+        if request.args.get("async", "").lower() in ("1", "true") or "respond-async" in request.headers.get("Prefer", ""):
+            try:
+                job = jobs.submit("create-listing", pipeline, *args)
+            except QueueFullError as e:
+                return jsonify({"error": str(e)}), 503
+            status_url = f"/jobs/{job.id}"
+            return jsonify({
+                "message": "Listing creation started",
+                "job_id": job.id,
+                "status_url": status_url,
+                "events_url": f"{status_url}/events",
+            }), 202, {"Location": status_url}
 
-        if not listing_json:
-            return jsonify({"error": "Failed to generate listing from image"}), 500
+        try:
+            listing = pipeline(*args)
+        except ListingPipelineError as e:
+            return jsonify({"error": str(e)}), e.status
 
-        # Parse the JSON string returned by image_to_listing
-        listing_data = json.loads(listing_json)
+        return jsonify({
+            "message": "Listing created successfully",
+            "data": listing
+        }), 201
+
+    # Create many listings from many images in one request
+    @app.route("/create-listings-from-images", methods=["POST"])
+    def create_listings_from_images():
+        max_items = get_bulk_max_items()
+        # MAX_UPLOAD_MB is per image here, so a full batch is not rejected before it is counted
+        request.max_content_length = get_max_bulk_upload_bytes(max_items)
+        try:
+            images = read_image_uploads(request)
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+
+        if len(images) > max_items:
+            return jsonify({"error": f"At most {max_items} images per request"}), 413
+
+        if request.args.get("async", "").lower() in ("1", "true") or "respond-async" in request.headers.get("Prefer", ""):
+            try:
+                job = jobs.submit("create-listings", create_listings, images, image_store)
+            except QueueFullError as e:
+                return jsonify({"error": str(e)}), 503
+            status_url = f"/jobs/{job.id}"
+            return jsonify({
+                "message": "Listing creation started",
+                "job_id": job.id,
+                "status_url": status_url,
+                "events_url": f"{status_url}/events",
+            }), 202, {"Location": status_url}
 
-        # Remove id field if it exists to let Supabase auto-generate it
-        if "id" in listing_data:
-            print(f"Removing id field: {listing_data['id']}")
-            del listing_data["id"]
+        results = create_listings(images, image_store)
+        created = sum(1 for result in results if result["status"] == "created")
 
-        # Set user_id to 1 regardless of what OpenAI returns
-        listing_data["user_id"] = 1
+        # 207 tells the client to look at the per-item statuses
+        return jsonify({
+            "message": f"Created {created} of {len(results)} listings",
+            "created": created,
+            "failed": len(results) - created,
+            "results": results,
+        }), 201 if created == len(results) else 207
+
+    # Poll a background job
+    @app.route("/jobs/<job_id>", methods=["GET"])
+    def get_job(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job.to_dict()), 200
+
+    # Follow a background job as server-sent events
+    @app.route("/jobs/<job_id>/events", methods=["GET"])
+    def get_job_events(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        return Response(
+            jobs.events(job, encoder=app.json.dumps),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
 
-        # Add the image encoding to the listing data
-        listing_data["image_encoding"] = base64_image
+    # Serve a stored listing image, ?size=small|medium for a thumbnail
+    @app.route("/images/<key>", methods=["GET"])
+    def get_image(key):
+        image = image_store.get(key, request.args.get("size", "original"))
+        if image is None:
+            return jsonify({"error": "Image not found"}), 404
+        data, content_type = image
+        # Keys are content hashes, so the bytes behind a URL never change
+        return Response(
+            data,
+            mimetype=content_type,
+            headers={
+                "Cache-Control": "public, max-age=31536000, immutable",
+                "ETag": f'"{key}"',
+            },
+        )
 
-        # Insert the new listing into Supabase
+    # Serve the QR code for a link, ?format=png|svg
+    @app.route("/qr", methods=["GET"])
+    def get_qr_code():
+        link = request.args.get("data")
+        if not link:
+            return jsonify({"error": "data is required"}), 400
+        if len(link.encode("utf-8")) > QR_MAX_DATA_BYTES:
+            return jsonify({"error": f"data must be at most {QR_MAX_DATA_BYTES} bytes"}), 400
+        fmt = request.args.get("format", "png")
+        if fmt not in QR_FORMATS:
+            return jsonify({"error": f"format must be one of {', '.join(QR_FORMATS)}"}), 400
+
+        etag = hashlib.sha256(f"{fmt}:{link}".encode("utf-8")).hexdigest()
+        if etag in request.if_none_match:
+            return Response(status=304, headers={"ETag": f'"{etag}"'})
         try:
-            response = insert_to_supabase('listings', listing_data)
-            product = stripe.Product.create(name=listing_data["title"])
-            price = stripe.Price.create(
-                product=product.id,
-                unit_amount=listing_data["price"],
-                currency="usd"
-            )
-            payment_link = stripe.PaymentLink.create(
-                line_items=[{
-                    "price": price.id,
-                    "quantity": 1
-                }]
-            )
-            qr_code = generate_qr_code(payment_link.url)  # Generate QR code for the payment link
-
-            return jsonify({
-                "message": "Listing created successfully",
-                "data": {
-                    **response.data,
-                    "stripe_product": product,
-                    "stripe_price": price,
-                    "stripe_payment_link": payment_link.url,
-                    "qr_code_encodings": qr_code  # Include the QR code in the response
-                }
-            }), 201
-        except Exception as e:
-            return jsonify({"error": f"Failed to create listing: {str(e)}"}), 500
+            image = render_qr_code(link, fmt)
+        except (DataOverflowError, ValueError) as e:
+            return jsonify({"error": f"Invalid QR data: {str(e)}"}), 400
+        return Response(
+            image,
+            mimetype=QR_FORMATS[fmt],
+            headers={
+                "Cache-Control": "public, max-age=86400",
+                "ETag": f'"{etag}"',
+            },
+        )
 
     # Push all listings for a merchant
     @app.route("/merchants/<merchant_id>/push-listings", methods=["POST"])
     async def push_listing(merchant_id):
-        buyers = supabase.table("users").select("id, username, preferences").execute()
-        listings = (
-            supabase.table("listings").select("*").eq("user_id", merchant_id).execute()
-        )
-        tasks = [
-            get_relevance_score(listing, buyer)
-            for listing in listings.data
-            for buyer in buyers.data
+        # Only score what changed since the last successful push, unless ?full=true
+        started_at = utc_now()
+        full = request.args.get("full", "").lower() in ("1", "true")
+        watermark = None if full else get_push_watermark(merchant_id)
+
+        # Served from the table cache unless a write invalidated it
+        buyers = select_rows("users", "id, username, preferences")
+        listings = select_rows("listings", LISTING_FEATURE_COLUMNS, user_id=merchant_id)
+        changed_listings = listings
+        changed_buyers = buyers
+        if watermark is not None:
+            with span("supabase.select", table="listings"):
+                changed_listings = select_changed(
+                    get_supabase().table("listings")
+                    .select(LISTING_FEATURE_COLUMNS)
+                    .eq("user_id", merchant_id),
+                    watermark,
+                ).execute().data
+            with span("supabase.select", table="users"):
+                changed_buyers = select_changed(
+                    get_supabase().table("users").select("id, username, preferences"),
+                    watermark,
+                ).execute().data
+
+        # New or edited listings against every buyer, plus the remaining
+        # listings against new or edited buyers
+        changed_ids = {listing["id"] for listing in changed_listings}
+        unchanged_listings = [
+            listing for listing in listings if listing["id"] not in changed_ids
         ]
-        responses = await asyncio.gather(*tasks)
 
-        # do something with the potential buyers later
-        print(responses)
+        # Narrow down to the closest buyers per listing before asking the LLM
+        with span("match.candidates"):
+            pairs = await asyncio.to_thread(candidate_pairs, changed_listings, buyers)
+            if changed_buyers and unchanged_listings:
+                pairs += await asyncio.to_thread(
+                    candidate_pairs, unchanged_listings, changed_buyers
+                )
 
-        # Placeholder response
-        return {"message": "Listings pushed successfully"}
-
-    @app.route("/create-realtime-key", methods=["GET"])
-    def create_realtime_key():
-        headers = {
-            "Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY')}",
-            "Content-Type": "application/json",
+        try:
+            with span("match.score"):
+                result = await score_all(pairs, mode=request.args.get("mode"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        save_matches(merchant_id, result.scores)
+
+        # Keep the old watermark when pairs failed so the next push retries them
+        if not result.failures:
+            set_push_watermark(merchant_id, started_at)
+
+        return {
+            "message": "Listings pushed successfully",
+            "scored": len(result.scores),
+            "failed": len(result.failures),
+            "cached": result.cached,
+            "failures": [failure.model_dump() for failure in result.failures],
         }
 
-        payload = {"model": "gpt-4o-realtime-preview-2024-12-17", "voice": "verse"}
+    # Get the best matching listings for a buyer
+    @app.route("/users/<user_id>/matches", methods=["GET"])
+    def get_matches(user_id):
+        k = request.args.get("k", default=10, type=int)
+        if not 1 <= k <= 100:
+            return jsonify({"error": "k must be between 1 and 100"}), 400
+        return jsonify(top_matches_for_buyer(user_id, k)), 200
 
+    @app.route("/create-realtime-key", methods=["GET"])
+    def create_realtime_key():
+        model = request.args.get("model", DEFAULT_REALTIME_MODEL)
+        voice = request.args.get("voice", DEFAULT_REALTIME_VOICE)
+        # Every pair gets its own pool of paid keys, so only configured ones are served
+        if model not in get_allowed_realtime_models():
+            return jsonify({"error": f"Unsupported model: {model}"}), 400
+        if voice not in get_allowed_realtime_voices():
+            return jsonify({"error": f"Unsupported voice: {voice}"}), 400
+
+        # Normally a key minted ahead of time; minted on the spot if the pool is empty
         try:
-            response = requests.post(
-                "https://api.openai.com/v1/realtime/sessions",
-                headers=headers,
-                json=payload,
-            )
-
-            response.raise_for_status()  # Raise an exception for HTTP errors
-            return jsonify(response.json()), 200
+            return jsonify(realtime_keys.take(model, voice)), 200
         except requests.exceptions.RequestException as e:
             return jsonify({"error": f"Failed to create realtime key: {str(e)}"}), 500
 
@@ -202,48 +487,32 @@ def create_app():
         product_id = listing_data["product_id"]
         price = listing_data["price"]
         
-        new_price = stripe.Price.create(
-            product=product_id,
-            unit_amount=price,
-            currency="usd"
-        )
-        payment_link = stripe.PaymentLink.create(
-            line_items=[{
-                "price": new_price.id,
-                "quantity": 1
-            }]
-        )
+        # Reuses an existing price and payment link at this amount when there is one
+        new_price, payment_link_url = price_index.get_or_create(product_id, price, "usd")
         return jsonify({
             "message": "Price updated successfully",
             "data": {
                 "product_id": product_id,
                 "price": new_price,
-                "payment_link": payment_link.url
+                "payment_link": payment_link_url
             }
         }), 200
     
-    # Create listing from image using v2 implementation
+    # Identify the products in an image, with listing fields and price ranges
     @app.route("/image-to-products", methods=["POST"])
     def image_to_products():
-        if not request.is_json:
-            return jsonify({"error": "Request must be JSON"}), 400
-
-        data = request.get_json()
-
-        # Check if base64_image is in the request
-        if "base64_image" not in data:
-            return jsonify({"error": "base64_image is required"}), 400
-
-        base64_image = data["base64_image"]
-
-        # Process image to generate product details using v2 implementation
-        result_json = image_to_listing_v2(base64_image)
+        try:
+            image = read_image_upload(request)
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
 
-        if not result_json:
-            return jsonify({"error": "Failed to analyze image"}), 500
+        # One vision call; pass analysis_id to /create-listing-from-image to reuse it
+        try:
+            result = analyze_products(image, image_store)
+        except ListingPipelineError as e:
+            return jsonify({"error": str(e)}), e.status
 
-        # Return the JSON response directly
-        return jsonify(json.loads(result_json)), 200
+        return jsonify(result), 200
 
     return app
 
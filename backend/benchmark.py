@@ -0,0 +1,319 @@
+"""
+Offline load benchmark for the backend.
+
+Starts create_app() on a local port against fake OpenAI, Supabase and Stripe
+servers (see fake_services.py), runs a load scenario per endpoint and
+reports latency percentiles, requests per second and peak RSS:
+
+    python benchmark.py
+    python benchmark.py --scenarios listings,push-listings --requests 500 --concurrency 32
+    python benchmark.py --scenarios push-listings --env RELEVANCE_MODE=batch
+    python benchmark.py --latency openai=1200 --error-rate openai=0.02 --json results.json
+
+The load generator runs in the same process as the app, so absolute numbers
+are pessimistic; compare runs made with the same options.
+"""
+import argparse
+import base64
+import io
+import json
+import logging
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import clients
+from fake_services import FakeOpenAI, FakeStripe, FakeSupabase
+
+DEFAULT_LATENCY_MS = {"openai": 400.0, "supabase": 15.0, "stripe": 120.0}
+DEFAULT_ERROR_RATE = {"openai": 0.0, "supabase": 0.0, "stripe": 0.0}
+
+SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.benchmark"
+
+
+def make_images(count, seed=0, size=256):
+    """Distinct base64 JPEGs, so every request misses the vision cache"""
+    from PIL import Image
+
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        image = Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3)))
+        image.putpixel((rng.randrange(size), rng.randrange(size)), (rng.randrange(256), 0, 0))
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=85)
+        images.append(base64.b64encode(buffer.getvalue()).decode("ascii"))
+    return images
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux; it is the peak, not the current size
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RSSSampler:
+    """Tracks the peak resident set size of this process while running"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = current_rss_bytes()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_bytes())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), round(q / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+def start_fakes(latency, error_rate, jitter, listings, users, merchants):
+    fakes = {
+        "openai": FakeOpenAI(latency["openai"], latency["openai"] * jitter, error_rate["openai"]),
+        "supabase": FakeSupabase(latency["supabase"], latency["supabase"] * jitter, error_rate["supabase"]),
+        "stripe": FakeStripe(latency["stripe"], latency["stripe"] * jitter, error_rate["stripe"]),
+    }
+    fakes["supabase"].seed(listings=listings, users=users, merchants=merchants)
+    for fake in fakes.values():
+        fake.start()
+    return fakes
+
+
+def start_app(fakes, overrides, no_cache):
+    """Points the backend at the fakes and serves create_app() on a free port"""
+    # Load .env first so it cannot override the settings below
+    clients.load_env()
+    env = {
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": f"{fakes['openai'].url}/v1",
+        "SUPABASE_URL": fakes["supabase"].url,
+        "SUPABASE_KEY": SUPABASE_KEY,
+        "STRIPE_API_KEY": "sk_test_benchmark",
+        "STRIPE_WARM_PRICES": "false",
+        "IMAGE_STORE": "local",
+        "IMAGE_STORE_PATH": tempfile.mkdtemp(prefix="benchmark-images-"),
+        "PRICE_SEARCH_BACKEND": "openai",
+        # The fakes have no rate limits; keep the scheduler out of the way
+        "OPENAI_RPM": "1000000",
+        "OPENAI_TPM": "1000000000",
+    }
+    if no_cache:
+        env.update({"VISION_CACHE_SIZE": "0", "SCORE_CACHE_SIZE": "0", "PRICE_SEARCH_CACHE_SIZE": "0"})
+    env.update(overrides)
+    os.environ.update(env)
+
+    import stripe
+    from werkzeug.serving import make_server
+
+    from app import create_app
+
+    app = create_app()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    stripe.api_base = fakes["stripe"].url
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="benchmark-app", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def scenarios(requests_per_scenario, merchants, listings):
+    """name -> (setup, request(session, base_url, i)); setup runs before timing starts"""
+    data = {}
+
+    def listing_images():
+        data["listing_images"] = make_images(requests_per_scenario, seed=1)
+
+    def product_images():
+        data["product_images"] = make_images(requests_per_scenario, seed=2)
+
+    def create_listing(session, base_url, i):
+        return session.post(f"{base_url}/create-listing-from-image", json={"base64_image": data["listing_images"][i]})
+
+    def image_to_products(session, base_url, i):
+        return session.post(f"{base_url}/image-to-products", json={"base64_image": data["product_images"][i]})
+
+    def get_listings(session, base_url, i):
+        cursor = random.randrange(max(1, listings - 50))
+        return session.get(f"{base_url}/listings", params={"limit": 50, "cursor": cursor})
+
+    def push_listings(session, base_url, i):
+        return session.post(f"{base_url}/merchants/{i % merchants + 1}/push-listings", params={"full": "true"})
+
+    def realtime_key(session, base_url, i):
+        return session.get(f"{base_url}/create-realtime-key")
+
+    return {
+        "create-listing": (listing_images, create_listing),
+        "image-to-products": (product_images, image_to_products),
+        "listings": (None, get_listings),
+        "push-listings": (None, push_listings),
+        "realtime-key": (None, realtime_key),
+    }
+
+
+def run_scenario(name, setup, send, base_url, total, concurrency, warmup, fakes):
+    if setup is not None:
+        setup()
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    for i in range(warmup):
+        send(session(), base_url, i)
+    for fake in fakes.values():
+        fake.reset_counts()
+
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def one(i):
+        started = time.perf_counter()
+        try:
+            status = send(session(), base_url, i).status_code
+        except requests.RequestException:
+            status = "error"
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    with RSSSampler() as rss:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Indexes after the warm-up ones, so no image is sent twice
+            list(executor.map(one, range(warmup, warmup + total)))
+        duration = time.perf_counter() - started
+
+    failed = sum(count for status, count in statuses.items() if status == "error" or status >= 400)
+    return {
+        "scenario": name,
+        "requests": total,
+        "concurrency": concurrency,
+        "failed": failed,
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "duration_s": duration,
+        "rps": total / duration if duration else None,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "peak_rss_mb": rss.peak / (1024 * 1024),
+        "upstream": {name: fake.stats() for name, fake in fakes.items()},
+    }
+
+
+def print_report(results):
+    header = f"{'scenario':<20}{'reqs':>6}{'fail':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'rss MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['scenario']:<20}{r['requests']:>6}{r['failed']:>6}{r['rps']:>9.1f}"
+            f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}{r['peak_rss_mb']:>9.1f}"
+        )
+    print()
+    for r in results:
+        upstream = ", ".join(
+            f"{name} {stats['requests']} ({stats['errors']} injected errors)" for name, stats in r["upstream"].items()
+        )
+        print(f"{r['scenario']}: upstream calls: {upstream}")
+
+
+def _service_values(pairs, defaults):
+    values = dict(defaults)
+    for pair in pairs or []:
+        service, _, value = pair.partition("=")
+        if service not in values:
+            raise SystemExit(f"Unknown service {service}, expected one of {', '.join(values)}")
+        values[service] = float(value)
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load benchmark for the backend")
+    parser.add_argument("--scenarios", default="create-listing,image-to-products,listings,push-listings",
+                        help="comma-separated scenarios: create-listing, image-to-products, listings, push-listings, realtime-key")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--push-requests", type=int, default=10,
+                        help="requests for push-listings, which scores every listing of a merchant per request")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed requests before each scenario")
+    parser.add_argument("--latency", action="append", metavar="SERVICE=MS", help="upstream latency, e.g. openai=800")
+    parser.add_argument("--jitter", type=float, default=0.25, help="latency jitter as a fraction of the latency")
+    parser.add_argument("--error-rate", action="append", metavar="SERVICE=FRACTION", help="injected error rate, e.g. stripe=0.05")
+    parser.add_argument("--listings", type=int, default=200, help="seeded listings")
+    parser.add_argument("--users", type=int, default=50, help="seeded buyers")
+    parser.add_argument("--merchants", type=int, default=10, help="merchants the listings belong to")
+    parser.add_argument("--no-cache", action="store_true", help="disable the vision, score and price caches")
+    parser.add_argument("--env", action="append", metavar="KEY=VALUE", help="extra backend settings, e.g. RELEVANCE_MODE=batch")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    overrides = dict(pair.partition("=")[::2] for pair in args.env or [])
+    fakes = start_fakes(
+        _service_values(args.latency, DEFAULT_LATENCY_MS),
+        _service_values(args.error_rate, DEFAULT_ERROR_RATE),
+        args.jitter,
+        args.listings,
+        args.users,
+        args.merchants,
+    )
+    server, base_url = start_app(fakes, overrides, args.no_cache)
+
+    available = scenarios(args.requests + args.warmup, args.merchants, args.listings)
+    results = []
+    try:
+        for name in [name.strip() for name in args.scenarios.split(",") if name.strip()]:
+            if name not in available:
+                raise SystemExit(f"Unknown scenario {name}, expected one of {', '.join(available)}")
+            setup, send = available[name]
+            total = args.push_requests if name == "push-listings" else args.requests
+            print(f"Running {name}: {total} requests, concurrency {args.concurrency}")
+            results.append(run_scenario(name, setup, send, base_url, total, args.concurrency, args.warmup, fakes))
+    finally:
+        server.shutdown()
+        for fake in fakes.values():
+            fake.stop()
+
+    print()
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
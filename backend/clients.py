@@ -0,0 +1,175 @@
+"""
+Shared clients for OpenAI, Supabase and plain HTTP.
+
+Each client is built the first time it is asked for and then reused, so
+importing a module never opens a connection or reads .env, and every caller
+shares the same keep-alive connection pool.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 20
+DEFAULT_TIMEOUT = 60.0
+
+_lock = threading.RLock()
+_clients = {}
+_env_loaded = False
+
+
+def load_env():
+    """Loads .env into the environment once per process"""
+    global _env_loaded
+    with _lock:
+        if not _env_loaded:
+            load_dotenv(override=True)
+            _env_loaded = True
+
+
+def get_pool_size() -> int:
+    load_env()
+    return int(os.environ.get("HTTP_POOL_SIZE", DEFAULT_POOL_SIZE))
+
+
+def get_timeout() -> float:
+    load_env()
+    return float(os.environ.get("HTTP_TIMEOUT", DEFAULT_TIMEOUT))
+
+
+def get_openai_base_url() -> str:
+    """OPENAI_BASE_URL, which the OpenAI SDK also reads, for calls made without it"""
+    load_env()
+    return (os.environ.get("OPENAI_BASE_URL") or "https://api.openai.com/v1").rstrip("/")
+
+
+def _get_or_create(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                load_env()
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def _openai_limits():
+    import httpx
+
+    return httpx.Limits(
+        max_connections=get_pool_size(),
+        max_keepalive_connections=get_pool_size(),
+    )
+
+
+def _observe_rate_limits(response):
+    from openai_scheduler import get_scheduler
+
+    get_scheduler().observe_headers(response.headers)
+
+
+async def _observe_rate_limits_async(response):
+    _observe_rate_limits(response)
+
+
+# Retries are left to the OpenAI scheduler, which also tracks rate limits
+def get_openai():
+    """The process-wide synchronous OpenAI client"""
+    from openai import DefaultHttpxClient, OpenAI
+
+    return _get_or_create(
+        "openai",
+        lambda: OpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            timeout=get_timeout(),
+            max_retries=0,
+            http_client=DefaultHttpxClient(
+                limits=_openai_limits(),
+                event_hooks={"response": [_observe_rate_limits]},
+            ),
+        ),
+    )
+
+
+def get_client_loop() -> asyncio.AbstractEventLoop:
+    """
+    The process-wide event loop that async clients live on, running in a
+    daemon thread. Flask runs each async view on a fresh loop, and async HTTP
+    connections belong to the loop that opened them, so async clients are
+    only shared when their calls run here (see run_on_client_loop).
+    """
+
+    def create_loop():
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="async-clients", daemon=True).start()
+        return loop
+
+    return _get_or_create("client_loop", create_loop)
+
+
+async def _run_in_context(coro, context):
+    return await asyncio.get_running_loop().create_task(coro, context=context)
+
+
+async def run_on_client_loop(coro):
+    """
+    Awaits `coro` on the client loop from any other loop. It runs in a copy
+    of the caller's context, so metrics spans still reach the request.
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        _run_in_context(coro, contextvars.copy_context()), get_client_loop()
+    )
+    return await asyncio.wrap_future(future)
+
+
+def get_async_openai():
+    """The process-wide AsyncOpenAI client; only usable on the client loop"""
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    if asyncio.get_running_loop() is not get_client_loop():
+        raise RuntimeError("The async OpenAI client must be used through run_on_client_loop")
+    return _get_or_create(
+        "async_openai",
+        lambda: AsyncOpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            timeout=get_timeout(),
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                limits=_openai_limits(),
+                event_hooks={"response": [_observe_rate_limits_async]},
+            ),
+        ),
+    )
+
+
+def get_supabase():
+    """The process-wide Supabase client"""
+    from supabase import ClientOptions, create_client
+
+    return _get_or_create(
+        "supabase",
+        lambda: create_client(
+            os.environ.get("SUPABASE_URL"),
+            os.environ.get("SUPABASE_KEY"),
+            options=ClientOptions(postgrest_client_timeout=get_timeout()),
+        ),
+    )
+
+
+def get_http_session() -> requests.Session:
+    """A requests session with a pooled, keep-alive connection adapter"""
+
+    def create_session():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=get_pool_size(), pool_maxsize=get_pool_size())
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    return _get_or_create("http", create_session)
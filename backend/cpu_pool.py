@@ -0,0 +1,121 @@
+"""
+Process pool for CPU-bound stages: image resizing and re-encoding,
+thumbnails and rendering of large QR codes.
+
+Request threads hold the GIL while they run this kind of work, which stalls
+every other request in the process. Running it in worker processes lets
+concurrent uploads use all cores. Large buffers are copied once into shared
+memory and read in place by the worker instead of being pickled through
+the pool's pipe; inputs under CPU_POOL_MIN_BYTES run inline, where the
+hand-off would cost more than the work.
+
+CPU_POOL_WORKERS sets the pool size (default: one per core on multi-core
+machines, 0 runs everything inline). Processes that start the pool must
+guard their entry point with `if __name__ == "__main__":`, as workers
+re-import the main module.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from metrics import count
+
+DEFAULT_MIN_BYTES = 256 * 1024
+
+# Imported once by the fork server, so each worker starts with them loaded
+PRELOAD_MODULES = ["image_preprocessing", "image_store", "qr_generator"]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_cpu_pool_workers() -> int:
+    # A single core gains nothing from a worker process but the hand-off cost
+    cores = os.cpu_count() or 1
+    return int(os.environ.get("CPU_POOL_WORKERS", cores if cores > 1 else 0))
+
+
+def get_cpu_pool_min_bytes() -> int:
+    return int(os.environ.get("CPU_POOL_MIN_BYTES", DEFAULT_MIN_BYTES))
+
+
+def _context():
+    # Forking a process that runs request threads can copy held locks into
+    # the child, so workers come from a fork server (or spawn) instead
+    methods = multiprocessing.get_all_start_methods()
+    if "forkserver" in methods:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(PRELOAD_MODULES)
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def get_cpu_pool():
+    """The shared process pool, or None when CPU_POOL_WORKERS is 0"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = get_cpu_pool_workers()
+                if workers <= 0:
+                    return None
+                _pool = ProcessPoolExecutor(max_workers=workers, mp_context=_context())
+    return _pool
+
+
+def run(fn, *args):
+    """Runs fn(*args) in the pool, or inline when the pool is disabled"""
+    pool = get_cpu_pool()
+    if pool is None:
+        count("cpu_pool_tasks_total", mode="inline")
+        return fn(*args)
+    count("cpu_pool_tasks_total", mode="pool")
+    return pool.submit(fn, *args).result()
+
+
+def map(fn, *iterables) -> list:
+    """Like the builtin map, spread over the pool's workers"""
+    pool = get_cpu_pool()
+    if pool is None:
+        return [fn(*args) for args in zip(*iterables)]
+    return list(pool.map(fn, *iterables))
+
+
+def _call_with_shared(fn, name, size, as_text, args):
+    # Workers share the parent's resource tracker, so attaching does not
+    # give the worker ownership; the parent unlinks the segment
+    shm = shared_memory.SharedMemory(name=name)
+    view = shm.buf[:size]
+    try:
+        if as_text:
+            return fn(str(view, "ascii"), *args)
+        return fn(view, *args)
+    finally:
+        view.release()
+        shm.close()
+
+
+def run_on_buffer(fn, data, *args):
+    """
+    Runs fn(data, *args), where data is bytes, a memoryview or a base64
+    string. Large inputs go to the pool through shared memory; there `fn`
+    receives a memoryview (or the string) and must not keep it.
+    """
+    pool = get_cpu_pool()
+    size = len(data)
+    if pool is None or size < get_cpu_pool_min_bytes():
+        count("cpu_pool_tasks_total", mode="inline")
+        return fn(data, *args)
+
+    as_text = isinstance(data, str)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        shm.buf[:size] = data.encode("ascii") if as_text else data
+        count("cpu_pool_tasks_total", mode="pool")
+        count("cpu_pool_shared_bytes_total", size)
+        return pool.submit(_call_with_shared, fn, shm.name, size, as_text, args).result()
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,438 @@
+"""
+Local stand-ins for the OpenAI, Supabase (PostgREST) and Stripe APIs.
+
+Each service is a small threaded HTTP server that answers the endpoints the
+backend calls with plausible data, after an optional delay and with an
+optional error rate, so the backend can be exercised offline:
+
+    openai = FakeOpenAI(latency_ms=800, error_rate=0.01).start()
+    os.environ["OPENAI_BASE_URL"] = openai.url + "/v1"
+
+Only what the backend uses is implemented.
+"""
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+from vector_index import HashingEmbedder
+
+CATEGORIES = ["laptop", "office chair", "desk lamp", "bicycle", "headphones", "coffee table", "camera", "sneakers"]
+CITIES = ["Singapore, Singapore", "Berlin, Germany", "Austin, USA", "Lisbon, Portugal"]
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeService:
+    """
+    Base class: subclasses implement handle(method, path, query, body,
+    headers) and return (status, body, extra headers).
+    """
+
+    name = "service"
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, host="127.0.0.1", port=0):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out as separate writes; with Nagle on, the
+            # body waits for the client's delayed ACK (about 40 ms a request)
+            disable_nagle_algorithm = True
+
+            def _dispatch(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                parts = urlsplit(self.path)
+                status, payload, headers = service._serve(
+                    self.command, parts.path, parts.query, body, self.headers
+                )
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        ThreadingHTTPServer.request_queue_size = 256
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=f"fake-{self.name}", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.calls = {}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "calls": dict(self.calls)}
+
+    def _serve(self, method, path, query, body, headers):
+        endpoint = f"{method} {re.sub(r'/[a-z]+_[A-Za-z0-9]+', '/{id}', path)}"
+        with self._lock:
+            self.requests += 1
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            return self.error()
+        try:
+            return self.handle(method, path, query, body, headers)
+        except Exception as e:
+            return 500, {"error": {"message": f"{type(e).__name__}: {e}"}}, {}
+
+    def error(self):
+        return 503, {"error": {"message": "Injected error"}}, {}
+
+    def handle(self, method, path, query, body, headers):
+        raise NotImplementedError
+
+
+class FakeOpenAI(FakeService):
+    """Chat completions (plain and structured), embeddings, responses and realtime sessions"""
+
+    name = "openai"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._embedder = HashingEmbedder(dim=64)
+
+    def error(self):
+        # Rate limit errors exercise the scheduler's retry path
+        return 429, {"error": {"message": "Injected rate limit", "type": "requests"}}, {"retry-after": "0.1"}
+
+    def handle(self, method, path, query, body, headers):
+        request = json.loads(body or b"{}")
+        if path == "/v1/chat/completions":
+            return 200, self._chat(request), {}
+        if path == "/v1/embeddings":
+            return 200, self._embeddings(request), {}
+        if path == "/v1/responses":
+            return 200, self._response(request), {}
+        if path == "/v1/realtime/sessions":
+            return 200, {
+                "id": f"sess_{uuid.uuid4().hex[:16]}",
+                "object": "realtime.session",
+                "model": request.get("model"),
+                "voice": request.get("voice"),
+                "client_secret": {"value": f"ek_{uuid.uuid4().hex}", "expires_at": int(time.time()) + 60},
+            }, {}
+        return 404, {"error": {"message": f"Unknown endpoint {path}"}}, {}
+
+    def _product(self):
+        category = random.choice(CATEGORIES)
+        low = random.randint(10, 400)
+        return {
+            "title": f"Used {category}",
+            "description": f"A {category} in good condition, lightly used.",
+            "price": low + random.randint(5, 50),
+            "min_price": low,
+            "max_price": low + random.randint(60, 200),
+            "location": random.choice(CITIES),
+            "category": category,
+        }
+
+    def _chat(self, request):
+        response_format = request.get("response_format") or {}
+        schema = (response_format.get("json_schema") or {}).get("name")
+        prompt = " ".join(
+            message["content"] if isinstance(message["content"], str) else ""
+            for message in request.get("messages", [])
+        )
+        if schema == "ImageAnalysis":
+            content = {"products": [self._product() for _ in range(random.randint(1, 2))]}
+        elif schema == "RelevanceScore":
+            content = {"relevance_score": random.randint(1, 10)}
+        elif schema == "PairScores":
+            content = {"scores": [
+                {"listing_id": int(listing_id), "user_id": int(user_id), "relevance_score": random.randint(1, 10)}
+                for listing_id in re.findall(r"\[listing (\d+)\]", prompt)
+                for user_id in re.findall(r"\[user (\d+)\]", prompt)
+            ]}
+        else:
+            product = self._product()
+            content = {key: product[key] for key in ("title", "description", "price", "location")}
+        text = json.dumps(content)
+        prompt_tokens = len(json.dumps(request.get("messages", []))) // 4
+        completion_tokens = len(text) // 4
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text, "refusal": None},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _embeddings(self, request):
+        texts = request.get("input")
+        texts = [texts] if isinstance(texts, str) else texts
+        vectors = self._embedder.embed(texts)
+        data = []
+        for index, vector in enumerate(vectors):
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype(np.float32).tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(text) for text in texts) // 4
+        return {
+            "object": "list",
+            "data": data,
+            "model": request.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _response(self, request):
+        # Price searches list one "- category" line per category
+        prompt = request.get("input") if isinstance(request.get("input"), str) else ""
+        ranges = []
+        for category in re.findall(r"^- (.+)$", prompt, re.MULTILINE):
+            low = random.randint(10, 400)
+            ranges.append({"category": category, "min_price": low, "max_price": low + random.randint(60, 200)})
+        text = f"Based on current listings:\n{json.dumps({'ranges': ranges})}"
+        return {
+            "id": f"resp_{uuid.uuid4().hex[:24]}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": request.get("model"),
+            "status": "completed",
+            "output": [{
+                "type": "message",
+                "id": f"msg_{uuid.uuid4().hex[:24]}",
+                "status": "completed",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }],
+            "usage": {"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4, "total_tokens": (len(prompt) + len(text)) // 4},
+        }
+
+
+class FakeSupabase(FakeService):
+    """
+    In-memory PostgREST: select with eq/neq/gt/gte/lt/lte/in filters, order
+    and limit, insert, upsert with on_conflict and delete.
+    """
+
+    name = "supabase"
+
+    # Tables whose rows get an id and timestamps on insert, like the real schema
+    TIMESTAMPED = {"listings", "users"}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tables = {}
+        self._next_ids = {}
+        self._table_lock = threading.Lock()
+
+    def seed(self, listings=500, users=200, merchants=10):
+        """Fills listings and users with generated rows"""
+        now = _utc_now()
+        for user_id in range(1, users + 1):
+            self._insert("users", {
+                "id": user_id,
+                "username": f"user{user_id}",
+                "preferences": f"Looking for a {random.choice(CATEGORIES)} or a {random.choice(CATEGORIES)}",
+                "created_at": now,
+                "updated_at": now,
+            })
+        for listing_id in range(1, listings + 1):
+            category = random.choice(CATEGORIES)
+            self._insert("listings", {
+                "id": listing_id,
+                "user_id": listing_id % merchants + 1,
+                "title": f"{category.title()} #{listing_id}",
+                "description": f"A {category} in good condition.",
+                "price": random.randint(10, 500),
+                "location": random.choice(CITIES),
+                "image_key": uuid.uuid4().hex * 2,
+                "created_at": now,
+                "updated_at": now,
+            })
+        return self
+
+    def _insert(self, table, row):
+        rows = self.tables.setdefault(table, [])
+        if table in self.TIMESTAMPED:
+            if "id" not in row:
+                row["id"] = self._next_ids.get(table, len(rows) + 1)
+            now = _utc_now()
+            row.setdefault("created_at", now)
+            row.setdefault("updated_at", now)
+        if "id" in row:
+            self._next_ids[table] = max(self._next_ids.get(table, 1), row["id"] + 1)
+        rows.append(row)
+        return row
+
+    @staticmethod
+    def _coerce(value, sample):
+        if isinstance(sample, bool):
+            return value == "true"
+        if isinstance(sample, int):
+            return int(value)
+        if isinstance(sample, float):
+            return float(value)
+        return value
+
+    def _matches(self, row, filters):
+        for column, condition in filters:
+            operator, _, value = condition.partition(".")
+            sample = row.get(column)
+            if sample is None:
+                return False
+            if operator == "in":
+                if sample not in [self._coerce(item, sample) for item in value.strip("()").split(",")]:
+                    return False
+                continue
+            value = self._coerce(value, sample)
+            if not {
+                "eq": sample == value,
+                "neq": sample != value,
+                "gt": sample > value,
+                "gte": sample >= value,
+                "lt": sample < value,
+                "lte": sample <= value,
+            }[operator]:
+                return False
+        return True
+
+    @staticmethod
+    def _project(row, select):
+        columns = [column.strip() for column in (select or "*").split(",")]
+        if "*" in columns:
+            return dict(row)
+        return {column: row[column] for column in columns if column in row}
+
+    def handle(self, method, path, query, body, headers):
+        match = re.fullmatch(r"/rest/v1/(\w+)", path)
+        if not match:
+            return 404, {"message": f"Unknown endpoint {path}"}, {}
+        table = match.group(1)
+        params = parse_qsl(query, keep_blank_values=True)
+        options = {key: value for key, value in params if key in ("select", "order", "limit", "offset", "on_conflict", "columns")}
+        filters = [(key, value) for key, value in params if key not in options]
+
+        with self._table_lock:
+            rows = self.tables.setdefault(table, [])
+            if method == "GET":
+                selected = [row for row in rows if self._matches(row, filters)]
+                for order in reversed((options.get("order") or "").split(",")):
+                    if order:
+                        column, _, direction = order.partition(".")
+                        selected.sort(
+                            key=lambda row: (row.get(column) is None, row.get(column) if row.get(column) is not None else 0),
+                            reverse=direction.startswith("desc"),
+                        )
+                offset = int(options.get("offset", 0))
+                limit = options.get("limit")
+                selected = selected[offset : offset + int(limit) if limit else None]
+                data = [self._project(row, options.get("select")) for row in selected]
+                return 200, data, {"Content-Range": f"{offset}-{offset + len(data) - 1}/*"}
+
+            if method == "POST":
+                payload = json.loads(body or b"[]")
+                payload = payload if isinstance(payload, list) else [payload]
+                conflict = [column.strip() for column in (options.get("on_conflict") or "").split(",") if column.strip()]
+                merge = "resolution=merge-duplicates" in headers.get("Prefer", "")
+                written = []
+                for item in payload:
+                    existing = None
+                    if merge and conflict:
+                        existing = next(
+                            (row for row in rows if all(row.get(column) == item.get(column) for column in conflict)),
+                            None,
+                        )
+                    if existing is not None:
+                        existing.update(item)
+                        if table in self.TIMESTAMPED:
+                            existing["updated_at"] = _utc_now()
+                        written.append(existing)
+                    else:
+                        written.append(self._insert(table, dict(item)))
+                return 201, [dict(row) for row in written], {}
+
+            if method == "DELETE":
+                deleted = [row for row in rows if self._matches(row, filters)]
+                self.tables[table] = [row for row in rows if not self._matches(row, filters)]
+                return 200, deleted, {}
+
+        return 405, {"message": f"Unsupported method {method}"}, {}
+
+
+class FakeStripe(FakeService):
+    """Products, prices and payment links, plus empty list endpoints for warm-up"""
+
+    name = "stripe"
+
+    def handle(self, method, path, query, body, headers):
+        form = dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+        if method == "GET" and (path in ("/v1/prices", "/v1/payment_links") or path.endswith("/line_items")):
+            return 200, {"object": "list", "data": [], "has_more": False, "url": path}, {}
+        if method != "POST":
+            return 404, {"error": {"message": f"Unknown endpoint {path}"}}, {}
+        if path == "/v1/products":
+            return 200, {"id": f"prod_{uuid.uuid4().hex[:14]}", "object": "product", "name": form.get("name"), "active": True}, {}
+        if path == "/v1/prices":
+            return 200, {
+                "id": f"price_{uuid.uuid4().hex[:14]}",
+                "object": "price",
+                "product": form.get("product"),
+                "unit_amount": int(form.get("unit_amount", 0)),
+                "currency": form.get("currency"),
+                "active": True,
+            }, {}
+        if path == "/v1/payment_links":
+            link_id = f"plink_{uuid.uuid4().hex[:14]}"
+            return 200, {"id": link_id, "object": "payment_link", "url": f"https://buy.stripe.com/test_{link_id}", "active": True}, {}
+        return 404, {"error": {"message": f"Unknown endpoint {path}"}}, {}
@@ -1,16 +1,247 @@
-from openai import OpenAI
+"""
+Price-range suggestions per product category from a web search.
+
+Categories are normalized ("Laptops" and "laptop" are the same category) and
+kept in a TTL cache, so similar items share one search and common items are
+answered from memory. Categories that miss the cache are looked up together
+in a single search call, and concurrent lookups of a category that is
+already being searched wait for that search instead of starting another.
+Request paths use cached_many, which never waits: misses are searched in
+the background and answered from the cache next time.
+
+The backend is chosen with PRICE_SEARCH_BACKEND: "openai" runs a web search
+through the Responses API, "static" answers from a JSON file of
+{"category": [min_price, max_price]} so the service works offline.
+"""
+import json
 import os
-from dotenv import load_dotenv
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+from clients import get_openai, load_env
+from listing_features import singular
+from metrics import span
+from openai_scheduler import BULK, estimate_tokens, get_scheduler
+from pydantic import BaseModel, Field
+
+MODEL = "gpt-4o"
+
+PROMPT = """Search the web for current second-hand prices of each of these product categories
+and suggest a reasonable min and max asking price in USD for a typical item of each:
+{categories}
+
+At the end, return the output in JSON format:
+{{"ranges": [{{"category": "category as given", "min_price": 80, "max_price": 120}}]}}"""
+
+DEFAULT_MAX_ENTRIES = 10_000
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_BATCH_SIZE = 10
+DEFAULT_BACKGROUND_WORKERS = 2
+
+
+class PriceRange(BaseModel):
+    """Suggested price range for a product category"""
+    category: str = Field(..., description="Normalized product category")
+    min_price: int = Field(..., description="Low end of the suggested price")
+    max_price: int = Field(..., description="High end of the suggested price")
+
+
+class PriceRanges(BaseModel):
+    ranges: list[PriceRange]
+
+
+def normalize_category(name: str) -> str:
+    """Lowercase, punctuation-free, singular form of a category name"""
+    words = re.sub(r"[^a-z0-9]+", " ", (name or "").lower()).split()
+    if words:
+        words[-1] = singular(words[-1])
+    return " ".join(words)
+
+
+class OpenAIPriceBackend:
+    """Looks up a batch of categories with one web-search Responses call"""
+
+    def search(self, categories: list) -> dict:
+        prompt = PROMPT.format(categories="\n".join(f"- {category}" for category in categories))
+        # Searches only run in the background, so they yield to vision calls
+        with span("openai.price_search"):
+            response = get_scheduler().run(
+                lambda: get_openai().responses.create(
+                    model=MODEL,
+                    tools=[{"type": "web_search_preview"}],
+                    input=prompt,
+                ),
+                priority=BULK,
+                tokens=estimate_tokens([{"role": "user", "content": prompt}], max_output_tokens=1000),
+            )
+        text = response.output_text or ""
+        # The answer ends with the JSON object, possibly after search notes
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end < start:
+            print("No price ranges received in response")
+            return {}
+        ranges = PriceRanges.model_validate_json(text[start : end + 1]).ranges
+        return {normalize_category(price_range.category): price_range for price_range in ranges}
+
+
+class StaticPriceBackend:
+    """Answers from a fixed {category: (min_price, max_price)} table"""
+
+    def __init__(self, prices=None):
+        self.prices = {
+            normalize_category(category): PriceRange(
+                category=normalize_category(category), min_price=low, max_price=high
+            )
+            for category, (low, high) in (prices or {}).items()
+        }
+        self.calls = 0
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def search(self, categories: list) -> dict:
+        self.calls += 1
+        return {category: self.prices[category] for category in categories if category in self.prices}
+
+
+class PriceSearch:
+    def __init__(self, backend, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, batch_size=DEFAULT_BATCH_SIZE):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.searches = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        # Kept apart from request executors, so slow searches never queue ahead of them
+        self._background = ThreadPoolExecutor(max_workers=DEFAULT_BACKGROUND_WORKERS, thread_name_prefix="price-search")
+
+    @classmethod
+    def from_env(cls):
+        backend = os.environ.get("PRICE_SEARCH_BACKEND", "openai")
+        if backend == "static":
+            path = os.environ.get("PRICE_SEARCH_STATIC_PATH")
+            backend = StaticPriceBackend.from_file(path) if path else StaticPriceBackend()
+        elif backend == "openai":
+            backend = OpenAIPriceBackend()
+        else:
+            raise ValueError(f"Unknown PRICE_SEARCH_BACKEND: {backend}")
+        return cls(
+            backend,
+            max_entries=int(os.environ.get("PRICE_SEARCH_CACHE_SIZE", DEFAULT_MAX_ENTRIES)),
+            ttl=float(os.environ.get("PRICE_SEARCH_TTL", DEFAULT_TTL)),
+            batch_size=max(1, int(os.environ.get("PRICE_SEARCH_BATCH_SIZE", DEFAULT_BATCH_SIZE))),
+        )
+
+    def _search(self, categories, futures):
+        """Runs the searches this caller owns and resolves their futures"""
+        for start in range(0, len(categories), self.batch_size):
+            batch = categories[start : start + self.batch_size]
+            try:
+                with self._lock:
+                    self.searches += 1
+                found = self.backend.search(batch)
+            except Exception as e:
+                print(f"Error searching prices: {str(e)}")
+                found = {}
+            expires_at = time.time() + self.ttl
+            with self._lock:
+                for category in batch:
+                    price_range = found.get(category)
+                    # Categories without an answer are searched again next time
+                    if price_range is not None:
+                        self._entries[category] = (price_range, expires_at)
+                        self._entries.move_to_end(category)
+                    self._in_flight.pop(category, None)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            for category in batch:
+                futures[category].set_result(found.get(category))
+
+    def suggest_many(self, names) -> dict:
+        """
+        Returns {normalized category: PriceRange or None} for the given
+        category names. Cache misses are searched in batches of `batch_size`.
+        """
+        categories = list(dict.fromkeys(normalize_category(name) for name in names if name))
+        results, waiting, owned = {}, {}, {}
+        now = time.time()
+        with self._lock:
+            for category in categories:
+                entry = self._entries.get(category)
+                if entry is not None and entry[1] >= now:
+                    self._entries.move_to_end(category)
+                    self.hits += 1
+                    results[category] = entry[0]
+                elif category in self._in_flight:
+                    self.coalesced += 1
+                    waiting[category] = self._in_flight[category]
+                else:
+                    self.misses += 1
+                    owned[category] = self._in_flight[category] = Future()
+
+        if owned:
+            self._search(list(owned), owned)
+        for category, future in {**owned, **waiting}.items():
+            results[category] = future.result()
+        return results
+
+    def suggest(self, name) -> Optional[PriceRange]:
+        return self.suggest_many([name]).get(normalize_category(name))
+
+    def cached_many(self, names) -> dict:
+        """
+        Returns {normalized category: PriceRange} for the categories that are
+        cached, without waiting on a search. The others are searched in the
+        background, unless a search for them is already running.
+        """
+        categories = list(dict.fromkeys(normalize_category(name) for name in names if name))
+        results, missing = {}, []
+        now = time.time()
+        with self._lock:
+            for category in categories:
+                entry = self._entries.get(category)
+                if entry is not None and entry[1] >= now:
+                    self._entries.move_to_end(category)
+                    self.hits += 1
+                    results[category] = entry[0]
+                elif category not in self._in_flight:
+                    missing.append(category)
+        if missing:
+            self.warm_in_background(missing)
+        return results
+
+    def warm_in_background(self, names):
+        """Searches the given categories without blocking the caller"""
+        return self._background.submit(self.suggest_many, list(names))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "searches": self.searches,
+                "size": len(self._entries),
+            }
 
-load_dotenv(override=True)
 
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+@lru_cache(maxsize=None)
+def get_price_search() -> PriceSearch:
+    load_env()
+    return PriceSearch.from_env()
 
-response = client.responses.create(
-    model="gpt-4o",
-    tools=[{"type": "web_search_preview"}],
-    input="""search up the prices of laptops and return me a reasonable price to set for my laptop? I want both a max and min price. ouput the price.
-    At the end, please return the output in JSON format with the following keys: "min_price" and "max_price"."""
-)
 
-print(response.output_text)
\ No newline at end of file
+if __name__ == "__main__":
+    print(get_price_search().suggest("laptops"))
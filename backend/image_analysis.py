@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+
+from clients import get_openai, load_env
+from image_preprocessing import decode_image, get_prepare_settings, prepare_image
+from metrics import span
+from openai_scheduler import INTERACTIVE, estimate_tokens, get_scheduler
+from pydantic import BaseModel, Field
+from vision_cache import get_vision_cache, vision_key
+
+MODEL = "gpt-4o"
+
+PROMPT = """Analyze this image and identify every product shown.
+For each product, write a listing with a title, a detailed description, a
+reasonable asking price as an integer, a plausible location as "City, Country",
+the low and high end of what similar items sell for as min_price and
+max_price, and a short generic category such as "laptop" or "office chair".
+List the most prominent product first."""
+
+DEFAULT_STORE_SIZE = 1024
+DEFAULT_STORE_TTL = 60 * 60
+
+
+class AnalyzedProduct(BaseModel):
+    """A product found in an image, with full listing fields and a price range"""
+    title: str = Field(..., description="Title of the listing")
+    description: str = Field(..., description="Description of the listing")
+    price: int = Field(..., description="Suggested price of the listing")
+    min_price: int = Field(..., description="Low end of the market price range")
+    max_price: int = Field(..., description="High end of the market price range")
+    location: str = Field(..., description="Location of the listing")
+    category: str = Field(..., description="Generic product category, such as laptop or office chair")
+
+
+class ImageAnalysis(BaseModel):
+    """Every product identified in one image"""
+    products: list[AnalyzedProduct]
+
+
+def listing_fields(product: AnalyzedProduct) -> dict:
+    """The fields of a product that go into the listings table"""
+    return {
+        "title": product.title,
+        "description": product.description,
+        "price": product.price,
+        "location": product.location,
+    }
+
+
+def product_range(product: AnalyzedProduct) -> dict:
+    """A product as /image-to-products has always returned it"""
+    return {
+        "name": product.title,
+        "min_price": product.min_price,
+        "max_price": product.max_price,
+    }
+
+
+def _analyze(image) -> Optional[ImageAnalysis]:
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": PROMPT
+                },
+                {
+                    "type": "image_url",
+                    "image_url": image.image_url()
+                },
+            ],
+        }
+    ]
+    # Sellers are waiting on this call, so it goes ahead of bulk work
+    with span("openai.vision"):
+        completion = get_scheduler().run(
+            lambda: get_openai().beta.chat.completions.parse(
+                model=MODEL,
+                messages=messages,
+                response_format=ImageAnalysis,
+            ),
+            priority=INTERACTIVE,
+            tokens=estimate_tokens(messages, max_output_tokens=800),
+        )
+    analysis = completion.choices[0].message.parsed
+    if analysis is None or not analysis.products:
+        print("No products received in response")
+        return None
+    return analysis
+
+
+def analyze_image(image) -> Optional[ImageAnalysis]:
+    """
+    Runs the single combined vision analysis for an image given as raw bytes
+    or a base64 string. Returns None if the analysis failed.
+    """
+    def prepare_and_analyze():
+        with span("image.prepare"):
+            prepared = prepare_image(data, *settings)
+        return _analyze(prepared)
+
+    try:
+        data = decode_image(image)
+        settings = get_prepare_settings()
+        # Identical uploads share one cached (or in-flight) analysis, found
+        # without decoding or resizing the image again
+        return get_vision_cache().get_or_compute(
+            vision_key(data, settings, MODEL, PROMPT), prepare_and_analyze
+        )
+    except Exception as e:
+        print(f"Error calling OpenAI API: {str(e)}")
+        return None
+
+
+class AnalysisStore:
+    """
+    Keeps recent analyses by id so a client can create listings from an
+    analysis it already has instead of uploading the image again.
+    """
+
+    def __init__(self, max_entries=DEFAULT_STORE_SIZE, ttl=DEFAULT_STORE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.environ.get("ANALYSIS_STORE_SIZE", DEFAULT_STORE_SIZE)),
+            ttl=float(os.environ.get("ANALYSIS_STORE_TTL", DEFAULT_STORE_TTL)),
+        )
+
+    def put(self, analysis: ImageAnalysis, image_key: str) -> str:
+        analysis_id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[analysis_id] = (analysis, image_key, time.time() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return analysis_id
+
+    def get(self, analysis_id):
+        """Returns (analysis, image_key), or None if unknown or expired"""
+        with self._lock:
+            entry = self._entries.get(analysis_id)
+            if entry is None:
+                return None
+            if entry[2] < time.time():
+                del self._entries[analysis_id]
+                return None
+            return entry[0], entry[1]
+
+
+@lru_cache(maxsize=None)
+def get_analysis_store() -> AnalysisStore:
+    load_env()
+    return AnalysisStore.from_env()
@@ -0,0 +1,136 @@
+import base64
+import os
+from io import BytesIO
+
+import cpu_pool
+from metrics import count
+from PIL import Image, ImageOps
+from pydantic import BaseModel
+
+# Images are downscaled so their longest edge is at most this many pixels
+DEFAULT_MAX_EDGE = 1536
+DEFAULT_QUALITY = 85
+
+# Images this small carry no extra information at "high" detail
+LOW_DETAIL_EDGE = 512
+
+# Formats the vision API accepts as-is
+SUPPORTED_MIME_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif"}
+
+MIME_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+class PreparedImage(BaseModel):
+    """An image ready to send to the vision API"""
+    base64_image: str
+    mime_type: str
+    detail: str
+    width: int
+    height: int
+    original_bytes: int
+    prepared_bytes: int
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.base64_image}"
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.prepared_bytes
+
+    def image_url(self) -> dict:
+        """The image_url content part for a chat completion message"""
+        return {"url": self.data_url, "detail": self.detail}
+
+
+def sniff_mime_type(data: bytes) -> str:
+    """Returns the image MIME type from the file's magic bytes"""
+    for signature, mime_type in MIME_SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return "application/octet-stream"
+
+
+def decode_image(image) -> bytes:
+    """Accepts raw bytes or a base64 string and returns the raw bytes"""
+    if isinstance(image, str):
+        return base64.b64decode(image)
+    return bytes(image)
+
+
+def decode_base64(image) -> bytes:
+    """Strict base64 decoding; raises binascii.Error on invalid input"""
+    return base64.b64decode(image, validate=True)
+
+
+def _prepare(image, max_edge, quality, detail) -> PreparedImage:
+    data = decode_image(image)
+    mime_type = sniff_mime_type(data)
+
+    with Image.open(BytesIO(data)) as source:
+        # Phone photos are often stored sideways with an EXIF rotation tag
+        picture = ImageOps.exif_transpose(source)
+        resized = max(picture.size) > max_edge
+        if resized:
+            picture.thumbnail((max_edge, max_edge))
+
+        prepared = data
+        if resized or mime_type not in SUPPORTED_MIME_TYPES or mime_type == "image/jpeg":
+            buffer = BytesIO()
+            picture.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True)
+            # Keep the original bytes if re-encoding did not help
+            if resized or mime_type not in SUPPORTED_MIME_TYPES or buffer.tell() < len(data):
+                prepared = buffer.getvalue()
+                mime_type = "image/jpeg"
+        width, height = picture.size
+
+    if detail == "auto":
+        detail = "low" if max(width, height) <= LOW_DETAIL_EDGE else "high"
+
+    return PreparedImage(
+        base64_image=base64.b64encode(prepared).decode("utf-8"),
+        mime_type=mime_type,
+        detail=detail,
+        width=width,
+        height=height,
+        original_bytes=len(data),
+        prepared_bytes=len(prepared),
+    )
+
+
+def get_prepare_settings() -> tuple:
+    """(max_edge, quality, detail) from VISION_MAX_EDGE, VISION_JPEG_QUALITY and VISION_DETAIL"""
+    return (
+        int(os.environ.get("VISION_MAX_EDGE", DEFAULT_MAX_EDGE)),
+        int(os.environ.get("VISION_JPEG_QUALITY", DEFAULT_QUALITY)),
+        os.environ.get("VISION_DETAIL", "auto"),
+    )
+
+
+def prepare_image(image, max_edge=None, quality=None, detail=None) -> PreparedImage:
+    """
+    Decodes an image, downscales it to `max_edge`, re-encodes it as JPEG when
+    that makes it smaller (or when the API cannot read its format) and picks
+    the `detail` level to request. Large images are processed in the CPU pool.
+    """
+    # Read here rather than in the worker, which may not see later env changes
+    default_max_edge, default_quality, default_detail = get_prepare_settings()
+    max_edge = max_edge or default_max_edge
+    quality = quality or default_quality
+    detail = detail or default_detail
+
+    result = cpu_pool.run_on_buffer(_prepare, image, max_edge, quality, detail)
+    count("vision_image_original_bytes_total", result.original_bytes)
+    count("vision_image_prepared_bytes_total", result.prepared_bytes)
+    # Re-encoding an unsupported format can grow it; counters only go up
+    count("vision_image_bytes_saved_total", max(result.bytes_saved, 0))
+    return result
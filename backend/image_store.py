@@ -0,0 +1,149 @@
+import hashlib
+import os
+import re
+import tempfile
+from io import BytesIO
+
+import cpu_pool
+from clients import get_supabase
+from image_preprocessing import sniff_mime_type
+from metrics import span
+from PIL import Image
+
+# Longest edge in pixels of each thumbnail generated at ingest
+THUMBNAIL_SIZES = {
+    "small": 128,
+    "medium": 512,
+}
+
+KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def make_thumbnails(data) -> dict:
+    """Returns {size: JPEG bytes} for every size in THUMBNAIL_SIZES"""
+    thumbnails = {}
+    with Image.open(BytesIO(data)) as image:
+        image = image.convert("RGB")
+        for size, edge in THUMBNAIL_SIZES.items():
+            thumbnail = image.copy()
+            thumbnail.thumbnail((edge, edge))
+            buffer = BytesIO()
+            thumbnail.save(buffer, format="JPEG", quality=85)
+            thumbnails[size] = buffer.getvalue()
+    return thumbnails
+
+
+def _blob_name(key, size):
+    return key if size == "original" else f"{key}_{size}"
+
+
+class LocalImageBackend:
+    """Stores blobs as files under a root directory, sharded by key prefix"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, name):
+        return os.path.join(self.root, name[:2], name[2:4], name)
+
+    def exists(self, name) -> bool:
+        return os.path.exists(self._path(name))
+
+    def put(self, name, data: bytes, content_type: str):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file of our own first, so readers never see a partial
+        # blob and concurrent uploads of the same image do not collide
+        with span("storage.put", backend="local"):
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{name}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as blob_file:
+                    blob_file.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                try:
+                    os.unlink(temp_path)
+                except FileNotFoundError:
+                    pass
+                raise
+
+    def get(self, name):
+        try:
+            with open(self._path(name), "rb") as blob_file:
+                return blob_file.read()
+        except FileNotFoundError:
+            return None
+
+
+class SupabaseStorageBackend:
+    """Stores blobs in a Supabase Storage bucket"""
+
+    def __init__(self, bucket, client=None):
+        self.bucket = bucket
+        self._client = client
+
+    def _bucket(self):
+        client = self._client or get_supabase()
+        return client.storage.from_(self.bucket)
+
+    def exists(self, name) -> bool:
+        with span("storage.exists", backend="supabase"):
+            return self._bucket().exists(name)
+
+    def put(self, name, data: bytes, content_type: str):
+        with span("storage.put", backend="supabase"):
+            self._bucket().upload(
+                name,
+                data,
+                {"content-type": content_type, "cache-control": "31536000", "upsert": "true"},
+            )
+
+    def get(self, name):
+        try:
+            return self._bucket().download(name)
+        except Exception:
+            return None
+
+
+class ImageStore:
+    """
+    Content-addressed image store. Images are keyed by the SHA-256 of their
+    bytes, so identical uploads are stored once, and thumbnails are
+    generated when an image is first stored.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def put(self, data: bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        if self.backend.exists(key):
+            return key
+
+        try:
+            # Decoding and resizing are the slow part; large images go to the CPU pool
+            with span("image.thumbnails"):
+                thumbnails = cpu_pool.run_on_buffer(make_thumbnails, data)
+        except Exception as e:
+            raise ValueError(f"Invalid image: {str(e)}")
+
+        for size, thumbnail in thumbnails.items():
+            self.backend.put(_blob_name(key, size), thumbnail, "image/jpeg")
+        # The original goes last so its presence means the thumbnails exist too
+        self.backend.put(key, data, sniff_mime_type(data))
+        return key
+
+    def get(self, key, size="original"):
+        """Returns (bytes, content_type), or None if the image is unknown"""
+        if not KEY_PATTERN.match(key) or (size != "original" and size not in THUMBNAIL_SIZES):
+            return None
+        data = self.backend.get(_blob_name(key, size))
+        if data is None:
+            return None
+        return data, sniff_mime_type(data)
+
+
+def get_image_store() -> ImageStore:
+    if os.environ.get("IMAGE_STORE", "local") == "supabase":
+        return ImageStore(SupabaseStorageBackend(os.environ.get("IMAGE_STORE_BUCKET", "images")))
+    return ImageStore(LocalImageBackend(os.environ.get("IMAGE_STORE_PATH", "images")))
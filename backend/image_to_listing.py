@@ -1,13 +1,8 @@
 import base64
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
+import json
+from image_analysis import analyze_image, listing_fields
 from pydantic import BaseModel, Field
 
-load_dotenv(override=True)
-
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-
 class Listing(BaseModel):
     """A listing object"""
     title: str = Field(..., description="Title of the listing")
@@ -22,48 +17,17 @@ def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
 
-def image_to_listing(base64_image):
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        { 
-                            "type": "text", 
-                            "text": """Analyze this image and create a product listing with the following JSON format:
-                            user_id is random 5 digits integer, title is a string, description is a string, price is a int, location is a string.
-                            {
-                                "title": "Product title",
-                                "user_id": "123",
-                                "description": "Detailed product description",
-                                "price": 99,
-                                "location": "City, Country"
-                            }"""
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        },
-                    ],
-                }
-            ],
-            response_format={"type": "json_object"}
-        )
-        
-        # print(f"Response status: {response.model_dump_json()[:100]}...")
-        
-        if response.choices and response.choices[0].message and response.choices[0].message.content:
-            return response.choices[0].message.content
-        else:
-            print("No content received in response")
-            return None
-    except Exception as e:
-        print(f"Error calling OpenAI API: {str(e)}")
+
+def image_to_listing(image):
+    """
+    Returns the listing fields of the most prominent product in an image
+    (raw bytes or a base64 string) as a JSON string, or None on failure.
+    Served by the same combined analysis as image_to_listing_v2.
+    """
+    analysis = analyze_image(image)
+    if analysis is None:
         return None
+    return json.dumps(listing_fields(analysis.products[0]))
 
 if __name__ == "__main__": 
     # Path to your image
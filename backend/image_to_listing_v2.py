@@ -1,57 +1,23 @@
 import base64
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
-from pydantic import BaseModel, Field
-
-load_dotenv(override=True)
-
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+import json
+from image_analysis import analyze_image, product_range
 
 # Function to encode the image
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
 
-def image_to_listing(base64_image):
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        { 
-                            "type": "text", 
-                            "text": """Analyze this image and identify the products shown.
-                            Create a product listing, with the following JSON format:
-                            {
-                                "name": "Product name",
-                                "min_price": 80,
-                                "max_price": 120
-                            },
-                            Include all identifiable products in the image."""
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        },
-                    ],
-                }
-            ],
-            response_format={"type": "json_object"}
-        )
-        
-        if response.choices and response.choices[0].message and response.choices[0].message.content:
-            return response.choices[0].message.content
-        else:
-            print("No content received in response")
-            return None
-    except Exception as e:
-        print(f"Error calling OpenAI API: {str(e)}")
+
+def image_to_listing(image):
+    """
+    Returns every product in an image (raw bytes or a base64 string) with its
+    price range as a JSON string, or None on failure. Served by the same
+    combined analysis as image_to_listing.
+    """
+    analysis = analyze_image(image)
+    if analysis is None:
         return None
+    return json.dumps({"products": [product_range(product) for product in analysis.products]})
 
 if __name__ == "__main__": 
     # Path to your image
@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 100
+
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION = 60 * 60
+
+
+class QueueFullError(Exception):
+    """Raised when too many jobs are already waiting to run"""
+
+
+class Job:
+    """A background job whose progress can be polled or streamed"""
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.version = 0
+        self.changed = threading.Condition()
+
+    def update(self, **fields):
+        with self.changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.updated_at = time.time()
+            self.version += 1
+            self.changed.notify_all()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded thread pool. A job function receives a
+    `report(stage)` callback and its return value becomes the job result;
+    any exception marks the job failed with the exception message.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_workers=int(os.environ.get("JOB_WORKERS", DEFAULT_WORKERS)),
+            max_pending=int(os.environ.get("JOB_MAX_PENDING", DEFAULT_MAX_PENDING)),
+        )
+
+    def submit(self, kind, fn, *args) -> Job:
+        job = Job(kind)
+        with self._lock:
+            self._expire()
+            if self._pending >= self.max_pending:
+                raise QueueFullError("Too many jobs queued, try again later")
+            self._pending += 1
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, *args)
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"pending": self._pending, "tracked": len(self._jobs)}
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, *args):
+        job.update(status="running")
+        try:
+            result = fn(*args, report=lambda stage: job.update(stage=stage))
+            job.update(status="succeeded", stage="done", result=result)
+        except Exception as e:
+            job.update(status="failed", error=str(e))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _expire(self):
+        cutoff = time.time() - JOB_RETENTION
+        for job_id in [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished and job.updated_at < cutoff
+        ]:
+            del self._jobs[job_id]
+
+    def events(self, job, heartbeat=15.0, encoder=json.dumps):
+        """Yields server-sent events for every change to the job until it finishes"""
+        version = -1
+        while True:
+            with job.changed:
+                if job.version == version:
+                    job.changed.wait(timeout=heartbeat)
+                if job.version == version:
+                    # Keep proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                version = job.version
+                payload = encoder(job.to_dict())
+                finished = job.finished
+            yield f"event: {job.status}\ndata: {payload}\n\n"
+            if finished:
+                return
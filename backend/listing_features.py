@@ -0,0 +1,113 @@
+import re
+from functools import lru_cache
+
+# Columns needed to describe a listing for matching, without the image payload
+LISTING_FEATURE_COLUMNS = "id, user_id, title, description, price, location"
+
+# Columns returned by GET /listings by default
+LISTING_LIST_COLUMNS = f"{LISTING_FEATURE_COLUMNS}, image_key"
+
+# Every column clients may ask for through GET /listings?fields=
+LISTING_COLUMNS = {
+    "id",
+    "user_id",
+    "title",
+    "description",
+    "price",
+    "location",
+    "image_key",
+    "image_encoding",
+    "created_at",
+    "updated_at",
+}
+
+# Long descriptions are cut to keep prompts small
+MAX_DESCRIPTION_CHARS = 400
+
+PRICE_BANDS = [
+    (25, "budget"),
+    (200, "mid-range"),
+    (1000, "premium"),
+]
+
+CATEGORY_KEYWORDS = {
+    "electronics": ["phone", "iphone", "laptop", "computer", "tablet", "camera", "headphones", "console", "tv", "monitor"],
+    "fashion": ["shirt", "dress", "jacket", "shoes", "sneakers", "bag", "watch", "jeans", "hat"],
+    "home": ["chair", "table", "sofa", "lamp", "desk", "bed", "kitchen", "mug", "plant"],
+    "sports": ["bike", "bicycle", "ball", "racket", "helmet", "skateboard", "gym", "yoga"],
+    "books": ["book", "novel", "textbook", "comic"],
+    "toys": ["toy", "lego", "puzzle", "doll", "game"],
+}
+
+
+def price_band(price) -> str:
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        return "unpriced"
+    for limit, band in PRICE_BANDS:
+        if price < limit:
+            return band
+    return "luxury"
+
+
+def listing_tags(title, description, price) -> list[str]:
+    """Derives a few coarse tags (category, price band) from listing text."""
+    words = set(re.findall(r"[a-z]+", f"{title} {description}".lower()))
+    tags = [
+        category
+        for category, keywords in CATEGORY_KEYWORDS.items()
+        if words.intersection(keywords)
+    ]
+    tags.append(price_band(price))
+    return tags
+
+
+def singular(word: str) -> str:
+    """Naive English singular of a lowercase word ("laptops" -> "laptop")"""
+    if len(word) <= 3 or word.endswith("ss"):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if re.search(r"(s|x|ch|sh)es$", word):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+@lru_cache(maxsize=4096)
+def _compact_listing(title, description, price, location) -> str:
+    if len(description) > MAX_DESCRIPTION_CHARS:
+        description = description[:MAX_DESCRIPTION_CHARS].rsplit(" ", 1)[0] + "..."
+    parts = [f"title: {title}"]
+    if description:
+        parts.append(f"description: {description}")
+    if price is not None:
+        parts.append(f"price: {price}")
+    if location:
+        parts.append(f"location: {location}")
+    parts.append(f"tags: {', '.join(listing_tags(title, description, price))}")
+    return "; ".join(parts)
+
+
+def listing_features(listing) -> str:
+    """
+    Returns a compact text description of a listing for prompts and
+    embeddings. Only the feature fields are used, so image data and other
+    columns never reach the model.
+    """
+    return _compact_listing(
+        str(listing.get("title") or ""),
+        " ".join(str(listing.get("description") or "").split()),
+        listing.get("price"),
+        str(listing.get("location") or ""),
+    )
+
+
+def buyer_features(buyer) -> str:
+    """Returns the buyer's preferences as plain text."""
+    preferences = buyer.get("preferences") or ""
+    if isinstance(preferences, (list, tuple)):
+        preferences = ", ".join(str(preference) for preference in preferences)
+    return f"preferences: {preferences}"
@@ -0,0 +1,311 @@
+import binascii
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from urllib.parse import urlencode
+
+import stripe
+from get_price_search import get_price_search, normalize_category
+from image_analysis import analyze_image, get_analysis_store, listing_fields, product_range
+from image_preprocessing import decode_base64
+from metrics import span
+from qr_generator import generate_qr_code
+from stripe_prices import price_index
+from supabase_functions import delete_from_supabase, insert_to_supabase
+
+# Runs the Supabase insert alongside the Stripe/QR branch of each listing
+_stage_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="listing-stage")
+
+DEFAULT_BULK_CONCURRENCY = 8
+DEFAULT_BULK_MAX_ITEMS = 50
+
+
+class ListingPipelineError(Exception):
+    """A listing could not be created; `status` is the HTTP status to report"""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+def _no_report(stage):
+    pass
+
+
+def inline_qr_codes() -> bool:
+    return os.environ.get("INLINE_QR_CODES", "true").lower() in ("1", "true")
+
+
+def create_stripe_checkout(title, unit_amount, idempotency_key=None):
+    """
+    Creates the Stripe product plus its price, payment link and QR code.
+    With an idempotency key, retrying the same checkout returns the product
+    Stripe created the first time instead of duplicating it; the price and
+    payment link go through the price index, which has its own keys.
+    """
+    with span("stripe.product_create"):
+        product = stripe.Product.create(
+            name=title,
+            idempotency_key=f"{idempotency_key}-product" if idempotency_key else None,
+        )
+    price, payment_link_url = price_index.get_or_create(product.id, unit_amount, "usd")
+    # Clients can fetch the QR code from qr_code_url instead of inlining it
+    qr_code = generate_qr_code(payment_link_url) if inline_qr_codes() else None
+    return product, price, payment_link_url, qr_code
+
+
+def store_image(image, image_store) -> tuple:
+    """
+    Stores an image given as raw bytes or a base64 string.
+    Returns (image bytes, image key).
+    """
+    with span("image.store"):
+        try:
+            # Inline: decoding runs near memory speed, and a worker would have to
+            # send the decoded bytes back through the pool's pipe
+            if isinstance(image, str):
+                image = decode_base64(image)
+        except (binascii.Error, ValueError) as e:
+            raise ListingPipelineError(f"Invalid image: {str(e)}", status=400)
+        image = bytes(image)
+        try:
+            return image, image_store.put(image)
+        except ValueError as e:
+            # Already reads "Invalid image: ..."
+            raise ListingPipelineError(str(e), status=400)
+        except OSError as e:
+            raise ListingPipelineError(f"Failed to store image: {str(e)}")
+
+
+def _listing_data(analysis, image_key, product_index=0) -> dict:
+    if not 0 <= product_index < len(analysis.products):
+        raise ListingPipelineError(f"product_index must be between 0 and {len(analysis.products) - 1}", status=400)
+    product = analysis.products[product_index]
+    listing_data = listing_fields(product)
+
+    # Used for the price suggestion, removed before the row is saved
+    listing_data["category"] = product.category
+
+    # Set user_id to 1 regardless of what OpenAI returns
+    listing_data["user_id"] = 1
+
+    # Reference the stored image instead of inlining it
+    listing_data["image_key"] = image_key
+    return listing_data
+
+
+def analyze_listing(image, image_store, report=_no_report, product_index=0) -> dict:
+    """
+    Stores the image and asks the vision model for the listing fields.
+    `image` is either raw bytes or a base64 string.
+    """
+    # Store the image up front so invalid uploads never reach OpenAI
+    report("storing_image")
+    image, image_key = store_image(image, image_store)
+
+    # Process image to generate listing details
+    report("analyzing_image")
+    analysis = analyze_image(image)
+
+    if analysis is None:
+        raise ListingPipelineError("Failed to generate listing from image")
+    return _listing_data(analysis, image_key, product_index)
+
+
+def analyze_products(image, image_store) -> dict:
+    """
+    Stores the image and runs the combined analysis once. The result is kept
+    under `analysis_id` so a listing can be created from any of its products
+    without uploading or analyzing the image again.
+    """
+    image, image_key = store_image(image, image_store)
+    analysis = analyze_image(image)
+    if analysis is None:
+        raise ListingPipelineError("Failed to analyze image")
+    return {
+        "analysis_id": get_analysis_store().put(analysis, image_key),
+        "image_key": image_key,
+        "products": [
+            {**product_range(product), **product.model_dump()}
+            for product in analysis.products
+        ],
+    }
+
+
+def stored_listing(analysis_id, product_index=0) -> dict:
+    """The listing fields of a product from an analysis kept by /image-to-products"""
+    stored = get_analysis_store().get(analysis_id)
+    if stored is None:
+        raise ListingPipelineError("Analysis not found or expired", status=404)
+    analysis, image_key = stored
+    return _listing_data(analysis, image_key, product_index)
+
+
+def suggest_prices(categories) -> dict:
+    """
+    Cached price ranges for the listings' categories, as {normalized
+    category: PriceRange}. Never waits on a search: categories that are not
+    cached yet are searched in the background for later listings.
+    """
+    try:
+        return get_price_search().cached_many([category for category in categories if category])
+    except Exception as e:
+        print(f"No price suggestions: {str(e)}")
+        return {}
+
+
+def _price_suggestion(suggestions, category):
+    """The suggested range for a category, or None if it is not cached yet"""
+    price_range = suggestions.get(normalize_category(category)) if category else None
+    return price_range.model_dump() if price_range is not None else None
+
+
+def listing_result(row, checkout, price_suggestion=None) -> dict:
+    product, price, payment_link_url, qr_code = checkout
+    return {
+        **row,
+        "price_suggestion": price_suggestion,
+        "image_url": f"/images/{row['image_key']}",
+        "stripe_product": product,
+        "stripe_price": price,
+        "stripe_payment_link": payment_link_url,
+        "qr_code_url": f"/qr?{urlencode({'data': payment_link_url})}",
+        "qr_code_encodings": qr_code  # Include the QR code in the response
+    }
+
+
+def create_listing(image, image_store, report=_no_report) -> dict:
+    """
+    Turns an uploaded image into a stored listing with a Stripe payment link.
+
+    `report(stage)` is called as each stage starts. Raises
+    ListingPipelineError when a stage fails.
+    """
+    return save_listing(analyze_listing(image, image_store, report), report)
+
+
+def create_listing_from_analysis(analysis_id, product_index=0, report=_no_report) -> dict:
+    """Like create_listing, for a product of an analysis kept by /image-to-products"""
+    return save_listing(stored_listing(analysis_id, product_index), report)
+
+
+def _discard_listing(row):
+    """Deletes a listing whose checkout failed, so a retry does not duplicate it"""
+    try:
+        delete_from_supabase("listings", "id", row["id"])
+    except Exception as e:
+        print(f"Error deleting listing {row['id']} after failed checkout: {str(e)}")
+
+
+def _discard_insert(insert):
+    try:
+        row = insert.result().data[0]
+    except Exception:
+        return
+    _discard_listing(row)
+
+
+def save_listing(listing_data, report=_no_report) -> dict:
+    """Inserts the listing and creates its Stripe checkout"""
+    # The Supabase insert and the Stripe/QR branch do not depend on each other
+    report("saving_listing")
+    category = listing_data.pop("category", None)
+    suggestions = suggest_prices([category])
+    # Run in a copy of this context so the insert's timings reach the request
+    insert = _stage_executor.submit(copy_context().run, insert_to_supabase, "listings", listing_data)
+    try:
+        # Keyed like bulk checkouts, so a retry reuses the Stripe objects
+        checkout = create_stripe_checkout(listing_data["title"], listing_data["price"], _checkout_key(listing_data))
+    except Exception as e:
+        _discard_insert(insert)
+        raise ListingPipelineError(f"Failed to create listing: {str(e)}")
+    try:
+        response = insert.result()
+    except Exception as e:
+        raise ListingPipelineError(f"Failed to create listing: {str(e)}")
+
+    return listing_result(response.data[0], checkout, _price_suggestion(suggestions, category))
+
+
+def get_bulk_concurrency() -> int:
+    return max(1, int(os.environ.get("BULK_CONCURRENCY", DEFAULT_BULK_CONCURRENCY)))
+
+
+def get_bulk_max_items() -> int:
+    return int(os.environ.get("BULK_MAX_ITEMS", DEFAULT_BULK_MAX_ITEMS))
+
+
+def _checkout_key(row) -> str:
+    # Same image, title and price always map to the same Stripe objects
+    fingerprint = f"{row['image_key']}:{row['title']}:{row['price']}"
+    return f"listing-{hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:32]}"
+
+
+def create_listings(images, image_store, concurrency=None, report=_no_report) -> list:
+    """
+    Creates one listing per image. Images are analyzed concurrently, all
+    listings are written with a single Supabase insert and the Stripe
+    objects are created concurrently with idempotency keys.
+
+    Returns one result per image, in order, each either
+    {"status": "created", "data": ...} or {"status": "failed", "error": ...}.
+    """
+    concurrency = concurrency or get_bulk_concurrency()
+    results = [None] * len(images)
+
+    def failed(index, error, status=500):
+        results[index] = {"index": index, "status": "failed", "error": error, "code": status}
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk-listing") as executor:
+        report("analyzing_images")
+        analyses = [
+            executor.submit(copy_context().run, analyze_listing, image, image_store)
+            for image in images
+        ]
+        analyzed = {}
+        for index, analysis in enumerate(analyses):
+            try:
+                analyzed[index] = analysis.result()
+            except ListingPipelineError as e:
+                failed(index, str(e), e.status)
+            except Exception as e:
+                failed(index, f"Failed to generate listing from image: {str(e)}")
+
+        if not analyzed:
+            return results
+
+        report("saving_listings")
+        indexes = list(analyzed)
+        categories = {index: analyzed[index].pop("category", None) for index in indexes}
+        suggestions = suggest_prices(categories.values())
+        try:
+            response = insert_to_supabase("listings", [analyzed[index] for index in indexes])
+        except Exception as e:
+            for index in indexes:
+                failed(index, f"Failed to create listing: {str(e)}")
+            return results
+
+        report("creating_checkouts")
+        rows = dict(zip(indexes, response.data))
+        checkouts = {
+            index: executor.submit(
+                copy_context().run, create_stripe_checkout, row["title"], row["price"], _checkout_key(row)
+            )
+            for index, row in rows.items()
+        }
+        for index, checkout in checkouts.items():
+            try:
+                results[index] = {
+                    "index": index,
+                    "status": "created",
+                    "data": listing_result(
+                        rows[index], checkout.result(), _price_suggestion(suggestions, categories[index])
+                    ),
+                }
+            except Exception as e:
+                # Same as a single listing: no row without a checkout
+                _discard_listing(rows[index])
+                failed(index, f"Failed to create listing: {str(e)}")
+
+    return results
@@ -0,0 +1,91 @@
+"""
+Persistence for push-listings results.
+
+Expects these tables next to `listings` and `users` (both of which need an
+`updated_at` timestamp maintained on insert and update):
+
+    create table matches (
+        listing_id bigint references listings(id) on delete cascade,
+        user_id bigint references users(id) on delete cascade,
+        merchant_id bigint not null,
+        relevance_score int not null,
+        scored_at timestamptz not null default now(),
+        primary key (listing_id, user_id)
+    );
+    create index matches_user_score_idx on matches (user_id, relevance_score desc);
+
+    create table push_watermarks (
+        merchant_id bigint primary key,
+        pushed_at timestamptz not null
+    );
+"""
+from datetime import datetime, timezone
+
+from clients import get_supabase
+from metrics import span
+from supabase_functions import upsert_to_supabase
+
+CHANGE_COLUMN = "updated_at"
+
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def get_push_watermark(merchant_id):
+    """Returns when the merchant's listings were last fully pushed, or None"""
+    with span("supabase.select", table="push_watermarks"):
+        response = (
+            get_supabase().table("push_watermarks")
+            .select("pushed_at")
+            .eq("merchant_id", merchant_id)
+            .execute()
+        )
+    return response.data[0]["pushed_at"] if response.data else None
+
+
+def set_push_watermark(merchant_id, pushed_at):
+    upsert_to_supabase(
+        "push_watermarks",
+        [{"merchant_id": merchant_id, "pushed_at": pushed_at}],
+        on_conflict="merchant_id",
+    )
+
+
+def select_changed(query, watermark):
+    """Restricts a query to rows created or updated after the watermark"""
+    if watermark is None:
+        return query
+    return query.gt(CHANGE_COLUMN, watermark)
+
+
+def save_matches(merchant_id, scores):
+    """Writes relevance scores to the matches table in one bulk upsert"""
+    if not scores:
+        return None
+    scored_at = utc_now()
+    rows = [
+        {
+            "listing_id": score.listing_id,
+            "user_id": score.user_id,
+            "merchant_id": merchant_id,
+            "relevance_score": score.relevance_score,
+            "scored_at": scored_at,
+        }
+        for score in scores
+    ]
+    return upsert_to_supabase("matches", rows, on_conflict="listing_id,user_id")
+
+
+def top_matches_for_buyer(user_id, k=10):
+    """Returns the k most relevant listings for a buyer, best first"""
+    with span("supabase.select", table="matches"):
+        response = (
+            get_supabase().table("matches")
+            .select("listing_id, relevance_score, scored_at")
+            .eq("user_id", user_id)
+            .order("relevance_score", desc=True)
+            .limit(k)
+            .execute()
+        )
+    return response.data
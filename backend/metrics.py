@@ -0,0 +1,233 @@
+"""
+In-process metrics: counters, latency histograms and timing spans, rendered
+in the Prometheus text format by the /metrics endpoint.
+
+    with span("supabase.insert", table="listings"):
+        ...
+
+records the block's duration in `stage_duration_seconds{stage=...}`, counts
+failures in `stage_errors_total` and adds the stage to the current
+request's timings, which app.py can return as a Server-Timing header.
+Work handed to another thread keeps reporting to the request when it is
+submitted through contextvars.copy_context().run.
+"""
+import contextvars
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+# Seconds; the same defaults Prometheus client libraries use, plus 30 and 60
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stage timings of the request being handled, as [(stage, seconds)]
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key, extra=()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: defaultdict(float))
+        self._histograms = defaultdict(dict)
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def count(self, name, amount=1, **labels):
+        with self._lock:
+            self._counters[name][_label_key(labels)] += amount
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            histogram = self._histograms[name].get(key)
+            if histogram is None:
+                histogram = self._histograms[name][key] = Histogram()
+            histogram.observe(value)
+
+    def register_collector(self, collect):
+        """
+        Adds collect(), called on every scrape, returning
+        {gauge name: value or {label tuple: value}} for values other
+        components already track, such as cache hit counts.
+        """
+        self._collectors.append(collect)
+
+    def _render_collected(self, lines):
+        gauges = defaultdict(dict)
+        for collect in self._collectors:
+            try:
+                for name, value in collect().items():
+                    if isinstance(value, dict):
+                        gauges[name].update(value)
+                    elif value is not None:
+                        gauges[name][()] = value
+            except Exception as e:
+                print(f"Metrics collector failed: {str(e)}")
+        for name in sorted(gauges):
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(gauges[name].items()):
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+            for name in sorted(self._histograms):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(histogram.total)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        self._render_collected(lines)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+registry.describe("stage_duration_seconds", "Time spent in each external call or CPU stage")
+registry.describe("stage_errors_total", "Stages that raised an exception")
+registry.describe("http_requests_total", "HTTP requests handled, by endpoint and status")
+registry.describe("http_request_duration_seconds", "HTTP request handling time")
+registry.describe("http_request_bytes_total", "Request body bytes received")
+registry.describe("http_response_bytes_total", "Response body bytes sent")
+registry.describe("openai_tokens_total", "Tokens reported by OpenAI responses")
+
+
+def count(name, amount=1, **labels):
+    registry.count(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+def register_collector(collect):
+    registry.register_collector(collect)
+
+
+def render() -> str:
+    return registry.render()
+
+
+def start_request_timings():
+    """Starts collecting span timings for the current request; returns a token for reset"""
+    return _timings.set([])
+
+
+def request_timings():
+    return _timings.get() or []
+
+
+def end_request_timings(token):
+    _timings.reset(token)
+
+
+@contextmanager
+def span(stage, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        count("stage_errors_total", stage=stage, **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        observe("stage_duration_seconds", elapsed, stage=stage, **labels)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def timed(stage, **labels):
+    """Decorator form of span()"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_openai_usage(usage):
+    """Counts the tokens of a chat/embeddings (prompt/completion) or Responses (input/output) usage"""
+    if usage is None:
+        return
+    for kind, attribute in (("prompt", "prompt_tokens"), ("completion", "completion_tokens"),
+                            ("prompt", "input_tokens"), ("completion", "output_tokens")):
+        value = getattr(usage, attribute, None)
+        if value:
+            count("openai_tokens_total", value, kind=kind)
+
+
+def server_timing(timings, total=None) -> str:
+    """
+    Formats stage timings as a Server-Timing header value. Repeated stages
+    are summed, so concurrent calls can add up to more than the total.
+    """
+    durations = {}
+    calls = {}
+    for stage, seconds in timings:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+        calls[stage] = calls.get(stage, 0) + 1
+    parts = [
+        f"{stage.replace('.', '-')};dur={seconds * 1000:.1f}"
+        + (f';desc="{calls[stage]} calls"' if calls[stage] > 1 else "")
+        for stage, seconds in durations.items()
+    ]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
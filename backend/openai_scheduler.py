@@ -0,0 +1,312 @@
+"""
+Process-wide scheduler for OpenAI calls.
+
+Every call waits for room in two token buckets, one for requests per
+minute and one for tokens per minute. Waiting calls are served in priority
+order, so interactive calls (a seller waiting on a listing) go ahead of
+bulk work (push-listings scoring). The buckets follow the x-ratelimit-*
+headers OpenAI returns, and 429/5xx responses are retried with jittered
+exponential backoff.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+
+from clients import load_env
+from metrics import record_openai_usage
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = {INTERACTIVE: 0, BULK: 1}
+
+DEFAULT_RPM = 500
+DEFAULT_TPM = 200_000
+DEFAULT_MAX_RETRIES = 4
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# Longest a waiter sleeps before checking the queue again
+POLL_INTERVAL = 0.05
+
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+# Rough image token costs for estimates
+LOW_DETAIL_IMAGE_TOKENS = 85
+HIGH_DETAIL_IMAGE_TOKENS = 1105
+
+
+def estimate_tokens(messages, max_output_tokens=500) -> int:
+    """Rough token estimate for a chat request: ~4 characters per token plus images and output"""
+    tokens = max_output_tokens
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                detail = part["image_url"].get("detail", "auto")
+                tokens += LOW_DETAIL_IMAGE_TOKENS if detail == "low" else HIGH_DETAIL_IMAGE_TOKENS
+            else:
+                tokens += len(json.dumps(part)) // 4
+    return tokens
+
+
+def _parse_duration(value) -> float:
+    """Parses OpenAI reset durations such as "1s", "6m0s" or "20ms" into seconds"""
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value or ""):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error) -> bool:
+    from openai import APIConnectionError, APITimeoutError
+
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    return _status_code(error) in RETRYABLE_STATUSES
+
+
+class TokenBucket:
+    """Refills continuously at `capacity` units per minute"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.blocked_until = 0.0
+        self._updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated_at) * self.capacity / 60)
+        self._updated_at = now
+
+    def wait_time(self, amount, now) -> float:
+        """Seconds until `amount` units are available (0 when they are)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        # A request larger than the whole bucket runs once the bucket is full
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+    def observe(self, limit, remaining, reset, now):
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+            if remaining <= 0 and reset:
+                self.blocked_until = now + reset
+
+
+class OpenAIScheduler:
+    def __init__(self, requests_per_minute=DEFAULT_RPM, tokens_per_minute=DEFAULT_TPM, max_retries=DEFAULT_MAX_RETRIES):
+        self.max_retries = max_retries
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._queue = []
+        self._sequence = itertools.count()
+        self._lock = threading.Condition()
+        self._metrics = {
+            priority: {"queued": 0, "calls": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0, "retries": 0, "errors": 0}
+            for priority in PRIORITIES
+        }
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            requests_per_minute=int(os.environ.get("OPENAI_RPM", DEFAULT_RPM)),
+            tokens_per_minute=int(os.environ.get("OPENAI_TPM", DEFAULT_TPM)),
+            max_retries=int(os.environ.get("OPENAI_MAX_RETRIES", DEFAULT_MAX_RETRIES)),
+        )
+
+    def _enqueue(self, priority, tokens):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        ticket = (PRIORITIES[priority], next(self._sequence), priority, tokens)
+        with self._lock:
+            heapq.heappush(self._queue, ticket)
+            self._metrics[priority]["queued"] += 1
+        return ticket
+
+    def _try_grant(self, ticket) -> float:
+        """Grants the ticket if it is first in line and capacity allows; returns seconds to wait otherwise"""
+        with self._lock:
+            if self._queue[0] is not ticket:
+                return POLL_INTERVAL
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(ticket[3], now))
+            if wait > 0:
+                return min(wait, POLL_INTERVAL * 10)
+            self._requests.level -= 1
+            self._tokens.level -= ticket[3]
+            heapq.heappop(self._queue)
+            self._metrics[ticket[2]]["queued"] -= 1
+            self._lock.notify_all()
+            return 0.0
+
+    def _record_wait(self, priority, waited):
+        with self._lock:
+            metrics = self._metrics[priority]
+            metrics["calls"] += 1
+            metrics["wait_seconds"] += waited
+            metrics["max_wait_seconds"] = max(metrics["max_wait_seconds"], waited)
+
+    def _cancel(self, ticket):
+        with self._lock:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._metrics[ticket[2]]["queued"] -= 1
+                self._lock.notify_all()
+
+    def acquire(self, priority=INTERACTIVE, tokens=1):
+        """Blocks until the call may be sent"""
+        started = time.monotonic()
+        ticket = self._enqueue(priority, tokens)
+        try:
+            while True:
+                wait = self._try_grant(ticket)
+                if wait == 0:
+                    break
+                with self._lock:
+                    self._lock.wait(wait)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        self._record_wait(priority, time.monotonic() - started)
+
+    async def acquire_async(self, priority=BULK, tokens=1):
+        """Waits without blocking the event loop until the call may be sent"""
+        started = time.monotonic()
+        ticket = self._enqueue(priority, tokens)
+        try:
+            while True:
+                wait = self._try_grant(ticket)
+                if wait == 0:
+                    break
+                await asyncio.sleep(wait)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        self._record_wait(priority, time.monotonic() - started)
+
+    def observe_headers(self, headers):
+        """Adjusts the buckets to the x-ratelimit-* headers of a response"""
+        def number(name):
+            try:
+                return int(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        now = time.monotonic()
+        with self._lock:
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            self._requests.observe(
+                number("x-ratelimit-limit-requests"),
+                number("x-ratelimit-remaining-requests"),
+                _parse_duration(headers.get("x-ratelimit-reset-requests")),
+                now,
+            )
+            self._tokens.observe(
+                number("x-ratelimit-limit-tokens"),
+                number("x-ratelimit-remaining-tokens"),
+                _parse_duration(headers.get("x-ratelimit-reset-tokens")),
+                now,
+            )
+
+    def _backoff(self, priority, attempt, error) -> float:
+        with self._lock:
+            self._metrics[priority]["retries"] += 1
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        # Full jitter keeps retrying callers from moving in lockstep
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    def _settle(self, estimated, result):
+        """Charges the difference between estimated and reported token usage"""
+        usage = getattr(result, "usage", None)
+        record_openai_usage(usage)
+        actual = getattr(usage, "total_tokens", None)
+        if actual is not None:
+            with self._lock:
+                self._tokens.level -= actual - estimated
+
+    def _record_error(self, priority):
+        with self._lock:
+            self._metrics[priority]["errors"] += 1
+
+    def run(self, call, priority=INTERACTIVE, tokens=1):
+        """Runs call() once the scheduler allows it, retrying 429/5xx errors"""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(priority, tokens)
+            try:
+                result = call()
+                self._settle(tokens, result)
+                return result
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    self._record_error(priority)
+                    raise
+                time.sleep(self._backoff(priority, attempt, e))
+
+    async def run_async(self, call, priority=BULK, tokens=1):
+        """Awaits call() once the scheduler allows it, retrying 429/5xx errors"""
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async(priority, tokens)
+            try:
+                result = await call()
+                self._settle(tokens, result)
+                return result
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    self._record_error(priority)
+                    raise
+                await asyncio.sleep(self._backoff(priority, attempt, e))
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            return {
+                "queue_depth": len(self._queue),
+                "requests_available": self._requests.level,
+                "tokens_available": self._tokens.level,
+                "priorities": {priority: dict(metrics) for priority, metrics in self._metrics.items()},
+            }
+
+
+@lru_cache(maxsize=None)
+def get_scheduler() -> OpenAIScheduler:
+    load_env()
+    return OpenAIScheduler.from_env()
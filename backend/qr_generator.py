@@ -1,55 +1,159 @@
 import qrcode
+import qrcode.image.svg
 import base64
+import os
+import threading
+from collections import OrderedDict
 from io import BytesIO
 
-def generate_qr_code(link, output_file=None):
-    """
-    Generates a QR code for the provided link and returns its base64 encoding.
-    Optionally saves it as an image file if output_file is provided.
+import cpu_pool
+from metrics import count, span
 
-    Parameters:
-        link (str): The URL or text to encode in the QR code.
-        output_file (str, optional): If provided, the filename for the output image.
-    
-    Returns:
-        str: Base64 encoded string representation of the QR code image.
-    """
+# Number of rendered QR codes kept in memory
+CACHE_SIZE = 1024
+
+# Data this long or longer is rendered in the CPU pool; shorter codes, such
+# as payment links, render faster inline than the hand-off to a worker
+DEFAULT_POOL_MIN_CHARS = 256
+
+# Most bytes a QR code (version 40, low error correction) can hold
+MAX_DATA_BYTES = 2953
+
+FORMATS = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_qr_pool_min_chars() -> int:
+    return int(os.environ.get("QR_POOL_MIN_CHARS", DEFAULT_POOL_MIN_CHARS))
+
+
+def _render(link, fmt, box_size, border):
     # Create a QRCode instance with desired configuration.
     qr = qrcode.QRCode(
         version=1,  # Controls the size of the QR Code; 1 is 21x21.
         error_correction=qrcode.constants.ERROR_CORRECT_L,  # About 7% error correction.
-        box_size=10,  # Size of each box in pixels.
-        border=4,  # Thickness of the border (boxes).
+        box_size=box_size,  # Size of each box in pixels.
+        border=border,  # Thickness of the border (boxes).
     )
-    
+
     # Add data (the link) to the QR code.
     qr.add_data(link)
     qr.make(fit=True)
 
+    # SVG is written as vector paths, without rasterizing through PIL
+    if fmt == "svg":
+        return qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).to_string()
+
     # Generate the image.
     img = qr.make_image(fill_color="black", back_color="white")
-    
+
     # Save the image to a BytesIO object
     buffer = BytesIO()
     img.save(buffer)
-    buffer.seek(0)
-    
+    return buffer.getvalue()
+
+
+def _remember(key, image):
+    with _cache_lock:
+        _cache[key] = image
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def render_qr_code(link, fmt="png", box_size=10, border=4):
+    """
+    Returns the QR code for the link as PNG or SVG bytes. Results are cached
+    by (link, options), so the same link is only rendered once.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported QR code format: {fmt}")
+    key = (link, fmt, box_size, border)
+    with _cache_lock:
+        image = _cache.get(key)
+        if image is not None:
+            _cache.move_to_end(key)
+            count("qr_cache_total", result="hit")
+            return image
+    count("qr_cache_total", result="miss")
+    with span("qr.render", format=fmt):
+        if len(link) >= get_qr_pool_min_chars():
+            image = cpu_pool.run(_render, link, fmt, box_size, border)
+        else:
+            image = _render(link, fmt, box_size, border)
+    _remember(key, image)
+    return image
+
+
+def generate_qr_code(link, output_file=None, fmt="png", box_size=10, border=4):
+    """
+    Generates a QR code for the provided link and returns its base64 encoding.
+    Optionally saves it as an image file if output_file is provided.
+
+    Parameters:
+        link (str): The URL or text to encode in the QR code.
+        output_file (str, optional): If provided, the filename for the output image.
+        fmt (str, optional): "png" (default) or "svg".
+
+    Returns:
+        str: Base64 encoded string representation of the QR code image.
+    """
+    image = render_qr_code(link, fmt, box_size, border)
+
     # Generate base64 string
-    base64_string = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    
+    base64_string = base64.b64encode(image).decode('utf-8')
+
     # Optionally save to file if output_file is provided
     if output_file:
-        img.save(output_file)
+        with open(output_file, "wb") as qr_file:
+            qr_file.write(image)
         print(f"QR code saved to {output_file}")
-        
+
     return base64_string
 
+
+def generate_qr_codes(links, fmt="png", box_size=10, border=4):
+    """
+    Generates base64 QR codes for many links, in order. Links that are not
+    cached yet and have at least QR_POOL_MIN_CHARS characters are rendered
+    across the shared CPU pool; shorter ones render inline.
+
+    Returns:
+        list[str]: Base64 encoded QR code images, one per link.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported QR code format: {fmt}")
+    with _cache_lock:
+        missing = list(dict.fromkeys(
+            link for link in links if (link, fmt, box_size, border) not in _cache
+        ))
+
+    long_links = [link for link in missing if len(link) >= get_qr_pool_min_chars()]
+    if len(long_links) > 1:
+        images = cpu_pool.map(
+            _render, long_links, [fmt] * len(long_links), [box_size] * len(long_links), [border] * len(long_links)
+        )
+        for link, image in zip(long_links, images):
+            _remember((link, fmt, box_size, border), image)
+
+    # Whatever is still missing renders through render_qr_code and is cached there
+    return [generate_qr_code(link, fmt=fmt, box_size=box_size, border=border) for link in links]
+
+
 # Example usage:
 if __name__ == "__main__":
     url = "https://www.example.com"
     # Get base64 string
     base64_qr = generate_qr_code(url)
     print(f"Base64 QR code: {base64_qr[:50]}...")  # Print first 50 chars
-    
+
     # Optionally save to file as well
     generate_qr_code(url, "example_qr.png")
+
+    # SVG skips PIL entirely
+    generate_qr_code(url, "example_qr.svg", fmt="svg")
@@ -0,0 +1,246 @@
+"""
+Prefetched ephemeral keys for OpenAI realtime sessions.
+
+Minting a session takes a full round trip to OpenAI, which the buyer and
+seller voice pages wait on before they can connect. RealtimeKeyPool keeps a
+few sessions per (model, voice) minted ahead of time: /create-realtime-key
+pops one, and when a pool drops below REALTIME_KEY_POOL_LOW_WATER a
+background refill tops it back up to REALTIME_KEY_POOL_SIZE.
+
+Ephemeral keys expire about a minute after they are minted, so a pooled
+key is only handed out while it has at least REALTIME_KEY_MIN_TTL seconds
+left, and a pool keeps being refilled only while it is being used: a
+(model, voice) that has not been asked for in REALTIME_KEY_POOL_IDLE seconds
+is dropped. A pool of N keys costs about N mints per key lifetime while
+it is active, whether or not they are used, so clients may only ask for the
+models and voices listed in REALTIME_MODELS and REALTIME_VOICES.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from clients import get_http_session, get_openai_base_url, get_timeout, load_env
+from metrics import span
+from openai_scheduler import BULK, INTERACTIVE, get_scheduler
+
+DEFAULT_MODEL = "gpt-4o-realtime-preview-2024-12-17"
+DEFAULT_VOICE = "verse"
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_LOW_WATER = 2
+DEFAULT_MIN_TTL = 20.0
+DEFAULT_IDLE_TIMEOUT = 10 * 60
+DEFAULT_REFILL_WORKERS = 4
+
+# Assumed lifetime of a key whose session does not say when it expires
+DEFAULT_KEY_TTL = 60.0
+
+# Longest the refill thread sleeps between expiry checks
+SWEEP_INTERVAL = 5.0
+
+
+def get_allowed_models() -> list[str]:
+    return [model.strip() for model in os.environ.get("REALTIME_MODELS", DEFAULT_MODEL).split(",") if model.strip()]
+
+
+def get_allowed_voices() -> list[str]:
+    return [voice.strip() for voice in os.environ.get("REALTIME_VOICES", DEFAULT_VOICE).split(",") if voice.strip()]
+
+
+def mint_session(model, voice, priority=INTERACTIVE) -> dict:
+    """Creates a realtime session and returns OpenAI's JSON response"""
+    headers = {
+        "Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY')}",
+        "Content-Type": "application/json",
+    }
+    payload = {"model": model, "voice": voice}
+
+    def create_session():
+        response = get_http_session().post(
+            f"{get_openai_base_url()}/realtime/sessions",
+            headers=headers,
+            json=payload,
+            timeout=get_timeout(),
+        )
+        get_scheduler().observe_headers(response.headers)
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        return response
+
+    with span("openai.realtime_session"):
+        return get_scheduler().run(create_session, priority=priority).json()
+
+
+def expires_at(session) -> float:
+    secret = session.get("client_secret")
+    if isinstance(secret, dict) and secret.get("expires_at"):
+        return float(secret["expires_at"])
+    return time.time() + DEFAULT_KEY_TTL
+
+
+class RealtimeKeyPool:
+    def __init__(
+        self,
+        size=DEFAULT_POOL_SIZE,
+        low_water=DEFAULT_LOW_WATER,
+        min_ttl=DEFAULT_MIN_TTL,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT,
+        refill_workers=DEFAULT_REFILL_WORKERS,
+        mint=mint_session,
+    ):
+        self.size = size
+        self.low_water = min(low_water, size)
+        self.min_ttl = min_ttl
+        self.idle_timeout = idle_timeout
+        self.mint = mint
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.minted = 0
+        self.errors = 0
+        # (model, voice) -> deque of (expires_at, session), oldest first
+        self._pools = {}
+        self._last_used = {}
+        self._minting = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=refill_workers, thread_name_prefix="realtime-key")
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            size=int(os.environ.get("REALTIME_KEY_POOL_SIZE", DEFAULT_POOL_SIZE)),
+            low_water=int(os.environ.get("REALTIME_KEY_POOL_LOW_WATER", DEFAULT_LOW_WATER)),
+            min_ttl=float(os.environ.get("REALTIME_KEY_MIN_TTL", DEFAULT_MIN_TTL)),
+            idle_timeout=float(os.environ.get("REALTIME_KEY_POOL_IDLE", DEFAULT_IDLE_TIMEOUT)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def take(self, model=DEFAULT_MODEL, voice=DEFAULT_VOICE) -> dict:
+        """
+        Returns a session with at least `min_ttl` seconds left, from the pool
+        when it has one and minted on the spot otherwise.
+        """
+        if not self.enabled:
+            return self.mint(model, voice)
+        key = (model, voice)
+        with self._lock:
+            self._last_used[key] = time.time()
+            session = self._pop_fresh(key)
+            if session is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._refill(key)
+        self._start()
+        if session is None:
+            session = self.mint(model, voice)
+        return session
+
+    def prefetch(self, model=DEFAULT_MODEL, voice=DEFAULT_VOICE):
+        """Fills the pool for (model, voice) in the background"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._last_used[(model, voice)] = time.time()
+            self._refill((model, voice))
+        self._start()
+
+    def _pop_fresh(self, key):
+        sessions = self._pools.get(key)
+        deadline = time.time() + self.min_ttl
+        while sessions:
+            expires, session = sessions.popleft()
+            if expires >= deadline:
+                return session
+            self.expired += 1
+        return None
+
+    def _drop_stale(self, key):
+        sessions = self._pools.get(key)
+        deadline = time.time() + self.min_ttl
+        while sessions and sessions[0][0] < deadline:
+            sessions.popleft()
+            self.expired += 1
+
+    def _refill(self, key):
+        """Starts mints to top the pool back up once it is below the low-water mark"""
+        available = len(self._pools.get(key, ())) + self._minting.get(key, 0)
+        if available >= max(self.low_water, 1):
+            return
+        for _ in range(self.size - available):
+            self._minting[key] = self._minting.get(key, 0) + 1
+            self._executor.submit(self._mint_into_pool, key)
+
+    def _mint_into_pool(self, key):
+        session = None
+        try:
+            session = self.mint(*key, priority=BULK)
+        except Exception as e:
+            print(f"Error prefetching realtime key: {str(e)}")
+        with self._lock:
+            self._minting[key] -= 1
+            if not self._minting[key]:
+                del self._minting[key]
+            if session is None:
+                # Retried by the next sweep rather than straight away
+                self.errors += 1
+                return
+            if key in self._last_used:
+                self.minted += 1
+                sessions = self._pools.setdefault(key, deque())
+                sessions.append((expires_at(session), session))
+                # Keys minted concurrently can finish out of order
+                if len(sessions) > 1 and sessions[-2][0] > sessions[-1][0]:
+                    self._pools[key] = deque(sorted(sessions, key=lambda entry: entry[0]))
+        self._wake.set()
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._sweep, name="realtime-key-sweep", daemon=True)
+                    self._thread.start()
+
+    def _sweep(self):
+        """Drops keys as they go stale and keeps pools in use refilled"""
+        while True:
+            self._wake.clear()
+            with self._lock:
+                now = time.time()
+                for key in list(self._last_used):
+                    if now - self._last_used[key] > self.idle_timeout:
+                        # Let an unused pool run dry instead of minting forever
+                        del self._last_used[key]
+                        self.expired += len(self._pools.pop(key, ()))
+                        continue
+                    self._drop_stale(key)
+                    self._refill(key)
+                next_stale = min(
+                    (sessions[0][0] - self.min_ttl for sessions in self._pools.values() if sessions),
+                    default=now + SWEEP_INTERVAL,
+                )
+            self._wake.wait(timeout=min(SWEEP_INTERVAL, max(0.0, next_stale - time.time())))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "minted": self.minted,
+                "errors": self.errors,
+                "size": sum(len(sessions) for sessions in self._pools.values()),
+            }
+
+
+@lru_cache(maxsize=None)
+def get_realtime_keys() -> RealtimeKeyPool:
+    load_env()
+    return RealtimeKeyPool.from_env()
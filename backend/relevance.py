@@ -0,0 +1,352 @@
+import asyncio
+import os
+from collections import defaultdict
+from typing import Optional
+
+from listing_features import buyer_features, listing_features
+from metrics import span
+from clients import get_async_openai, run_on_client_loop
+from openai import AsyncOpenAI, BadRequestError, LengthFinishReasonError
+from openai_scheduler import BULK, estimate_tokens, get_scheduler
+from pydantic import BaseModel
+from score_cache import get_score_cache, score_key
+
+RELEVANCE_MODEL = "gpt-4o-mini"
+
+SYSTEM_PROMPT = "You are a recommendation system that rates how relevant items are to users based on their preferences. Return a relevance score from 1-10, where 1 is least relevant and 10 is most relevant."
+
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + " You will be given several listings and users, each tagged with an id. Return exactly one score for every listing and user combination, using those ids."
+
+# Defaults for the scoring fan-out, overridable through the environment
+DEFAULT_CONCURRENCY = 16
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_BATCH_SIZE = 25
+DEFAULT_MODE = "pair"
+
+# Batches whose prompt grows past this many characters are split in half
+MAX_BATCH_PROMPT_CHARS = 32000
+
+
+class RelevanceScore(BaseModel):
+    relevance_score: int
+
+
+class RelevanceScoreWithUser(RelevanceScore):
+    user_id: int
+    username: str
+    listing_id: Optional[int] = None
+
+
+class PairScore(BaseModel):
+    listing_id: int
+    user_id: int
+    relevance_score: int
+
+
+class PairScores(BaseModel):
+    scores: list[PairScore]
+
+
+class ScoringFailure(BaseModel):
+    listing_id: Optional[int] = None
+    user_id: Optional[int] = None
+    error: str
+
+
+class ScoringResult(BaseModel):
+    scores: list[RelevanceScoreWithUser]
+    failures: list[ScoringFailure]
+    cached: int = 0
+
+
+def get_scoring_concurrency() -> int:
+    return max(1, int(os.environ.get("RELEVANCE_CONCURRENCY", DEFAULT_CONCURRENCY)))
+
+
+def get_scoring_timeout() -> float:
+    return float(os.environ.get("RELEVANCE_TIMEOUT", DEFAULT_TIMEOUT))
+
+
+def get_scoring_batch_size() -> int:
+    return max(1, int(os.environ.get("RELEVANCE_BATCH_SIZE", DEFAULT_BATCH_SIZE)))
+
+
+def get_scoring_mode() -> str:
+    return os.environ.get("RELEVANCE_MODE", DEFAULT_MODE)
+
+
+async def _parse(client: AsyncOpenAI, messages, response_format, timeout, max_output_tokens):
+    # Bulk scoring yields to interactive calls; the timeout covers the API call, not the queue
+    with span("openai.relevance"):
+        return await get_scheduler().run_async(
+            lambda: asyncio.wait_for(
+                client.beta.chat.completions.parse(
+                    model=RELEVANCE_MODEL,
+                    messages=messages,
+                    response_format=response_format,
+                ),
+                timeout,
+            ),
+            priority=BULK,
+            tokens=estimate_tokens(messages, max_output_tokens),
+        )
+
+
+async def get_relevance_score(listing, buyer, client: AsyncOpenAI, timeout=None) -> RelevanceScoreWithUser:
+    messages = [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT,
+        },
+        {
+            "role": "user",
+            "content": f"Rate how relevant this listing is to the user's preferences:\nListing: {listing_features(listing)}\nUser {buyer_features(buyer)}",
+        },
+    ]
+    completion = await _parse(client, messages, RelevanceScore, timeout, max_output_tokens=20)
+    result = completion.choices[0].message.parsed
+    return RelevanceScoreWithUser(
+        relevance_score=result.relevance_score,
+        user_id=buyer.get("id"),
+        username=buyer.get("username"),
+        listing_id=listing.get("id"),
+    )
+
+
+def _batch_prompt(listings, buyers) -> str:
+    listing_lines = "\n".join(
+        f"[listing {listing.get('id')}] {listing_features(listing)}" for listing in listings
+    )
+    buyer_lines = "\n".join(f"[user {buyer.get('id')}] {buyer_features(buyer)}" for buyer in buyers)
+    return f"Rate how relevant each listing is to each user's preferences.\nListings:\n{listing_lines}\nUsers:\n{buyer_lines}"
+
+
+async def get_relevance_scores_batch(listings, buyers, client: AsyncOpenAI, timeout=None) -> list[RelevanceScoreWithUser]:
+    """Scores every listing against every buyer with a single structured-output call."""
+    messages = [
+        {
+            "role": "system",
+            "content": BATCH_SYSTEM_PROMPT,
+        },
+        {
+            "role": "user",
+            "content": _batch_prompt(listings, buyers),
+        },
+    ]
+    completion = await _parse(
+        client, messages, PairScores, timeout, max_output_tokens=30 * len(listings) * len(buyers)
+    )
+    result = completion.choices[0].message.parsed
+    buyers_by_id = {buyer.get("id"): buyer for buyer in buyers}
+    listing_ids = {listing.get("id") for listing in listings}
+
+    scores = {}
+    for score in result.scores:
+        buyer = buyers_by_id.get(score.user_id)
+        # Ignore ids the model made up
+        if buyer is None or score.listing_id not in listing_ids:
+            continue
+        scores[(score.listing_id, score.user_id)] = RelevanceScoreWithUser(
+            relevance_score=score.relevance_score,
+            user_id=score.user_id,
+            username=buyer.get("username"),
+            listing_id=score.listing_id,
+        )
+    return list(scores.values())
+
+
+def _group_pairs(pairs, batch_size):
+    """
+    Groups pairs into batches of one listing and many buyers, or one buyer and
+    many listings, whichever axis needs fewer calls.
+    """
+    listings = {}
+    buyers = {}
+    buyers_by_listing = defaultdict(list)
+    listings_by_buyer = defaultdict(list)
+    for listing, buyer in pairs:
+        listings[listing.get("id")] = listing
+        buyers[buyer.get("id")] = buyer
+        buyers_by_listing[listing.get("id")].append(buyer)
+        listings_by_buyer[buyer.get("id")].append(listing)
+
+    batches = []
+    if len(listings) <= len(buyers):
+        for listing_id, listing_buyers in buyers_by_listing.items():
+            for i in range(0, len(listing_buyers), batch_size):
+                batches.append(([listings[listing_id]], listing_buyers[i : i + batch_size]))
+    else:
+        for buyer_id, buyer_listings in listings_by_buyer.items():
+            for i in range(0, len(buyer_listings), batch_size):
+                batches.append((buyer_listings[i : i + batch_size], [buyers[buyer_id]]))
+    return batches
+
+
+def _split_batch(listings, buyers):
+    if len(listings) > 1:
+        half = len(listings) // 2
+        return [(listings[:half], buyers), (listings[half:], buyers)]
+    half = len(buyers) // 2
+    return [(listings, buyers[:half]), (listings, buyers[half:])]
+
+
+async def score_pairs_batched(pairs, batch_size=None, concurrency=None, timeout=None) -> ScoringResult:
+    """
+    Scores (listing, buyer) pairs with one LLM call per batch instead of one
+    per pair.
+
+    Batches that are too large for a single prompt, or that the model cannot
+    finish, are split in half and retried. Pairs missing from the model's
+    answer are reported as failures.
+    """
+    batch_size = batch_size or get_scoring_batch_size()
+    concurrency = concurrency or get_scoring_concurrency()
+    timeout = timeout or get_scoring_timeout()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    def failed(listings, buyers, error):
+        return [
+            ScoringFailure(listing_id=listing.get("id"), user_id=buyer.get("id"), error=error)
+            for listing in listings
+            for buyer in buyers
+        ]
+
+    client = get_async_openai()
+
+    async def score_batch(listings, buyers):
+        splittable = len(listings) * len(buyers) > 1
+        if splittable and len(_batch_prompt(listings, buyers)) > MAX_BATCH_PROMPT_CHARS:
+            return await split_and_score(listings, buyers)
+
+        try:
+            async with semaphore:
+                scores = await get_relevance_scores_batch(listings, buyers, client, timeout)
+        except (LengthFinishReasonError, BadRequestError) as e:
+            if splittable:
+                return await split_and_score(listings, buyers)
+            return [], failed(listings, buyers, str(e))
+        except asyncio.TimeoutError:
+            return [], failed(listings, buyers, "timed out")
+        except Exception as e:
+            return [], failed(listings, buyers, str(e) or type(e).__name__)
+
+        scored = {(score.listing_id, score.user_id) for score in scores}
+        missing = [
+            ScoringFailure(listing_id=listing.get("id"), user_id=buyer.get("id"), error="missing from batch response")
+            for listing in listings
+            for buyer in buyers
+            if (listing.get("id"), buyer.get("id")) not in scored
+        ]
+        return scores, missing
+
+    async def split_and_score(listings, buyers):
+        halves = await asyncio.gather(
+            *(score_batch(*half) for half in _split_batch(listings, buyers))
+        )
+        return (
+            [score for scores, _ in halves for score in scores],
+            [failure for _, failures in halves for failure in failures],
+        )
+
+    results = await asyncio.gather(
+        *(score_batch(*batch) for batch in _group_pairs(pairs, batch_size))
+    )
+
+    return ScoringResult(
+        scores=[score for scores, _ in results for score in scores],
+        failures=[failure for _, failures in results for failure in failures],
+    )
+
+
+async def score_all(pairs, mode=None) -> ScoringResult:
+    """
+    Scores pairs one call per pair ("pair") or several per call ("batch").
+    Pairs whose listing features and buyer preferences were scored before
+    are served from the score cache without calling the model.
+    """
+    mode = mode or get_scoring_mode()
+    if mode == "batch":
+        scorer = score_pairs_batched
+        version = f"{RELEVANCE_MODEL}:{BATCH_SYSTEM_PROMPT}"
+    elif mode == "pair":
+        scorer = score_pairs
+        version = f"{RELEVANCE_MODEL}:{SYSTEM_PROMPT}"
+    else:
+        raise ValueError(f"Unknown relevance scoring mode: {mode}")
+
+    cached = []
+    uncached = []
+    keys = {}
+    for listing, buyer in pairs:
+        key = score_key(listing, buyer, version)
+        score = get_score_cache().get(key)
+        if score is None:
+            keys[(listing.get("id"), buyer.get("id"))] = key
+            uncached.append((listing, buyer))
+        else:
+            cached.append(
+                RelevanceScoreWithUser(
+                    relevance_score=score,
+                    user_id=buyer.get("id"),
+                    username=buyer.get("username"),
+                    listing_id=listing.get("id"),
+                )
+            )
+
+    if not uncached:
+        return ScoringResult(scores=cached, failures=[], cached=len(cached))
+
+    # Scoring runs on the long-lived client loop so every request shares one client
+    result = await run_on_client_loop(scorer(uncached))
+    get_score_cache().set_many(
+        {
+            keys[(score.listing_id, score.user_id)]: score.relevance_score
+            for score in result.scores
+            if (score.listing_id, score.user_id) in keys
+        }
+    )
+    return ScoringResult(
+        scores=cached + result.scores,
+        failures=result.failures,
+        cached=len(cached),
+    )
+
+
+async def score_pairs(pairs, concurrency=None, timeout=None) -> ScoringResult:
+    """
+    Scores (listing, buyer) pairs concurrently on a shared async client.
+
+    At most `concurrency` requests are in flight at once and each pair is
+    given `timeout` seconds. A pair that fails or times out is reported in
+    `failures` instead of failing the whole run.
+    """
+    concurrency = concurrency or get_scoring_concurrency()
+    timeout = timeout or get_scoring_timeout()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    client = get_async_openai()
+
+    async def score_one(listing, buyer):
+        async with semaphore:
+            return await get_relevance_score(listing, buyer, client, timeout)
+
+    results = await asyncio.gather(
+        *(score_one(listing, buyer) for listing, buyer in pairs),
+        return_exceptions=True,
+    )
+
+    scores = []
+    failures = []
+    for (listing, buyer), result in zip(pairs, results):
+        if isinstance(result, BaseException):
+            error = "timed out" if isinstance(result, asyncio.TimeoutError) else str(result)
+            failures.append(
+                ScoringFailure(
+                    listing_id=listing.get("id"),
+                    user_id=buyer.get("id"),
+                    error=error or type(result).__name__,
+                )
+            )
+        else:
+            scores.append(result)
+    return ScoringResult(scores=scores, failures=failures)
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+
+from clients import load_env
+from listing_features import buyer_features, listing_features
+
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def score_key(listing, buyer, version: str) -> str:
+    """
+    Cache key for a (listing, buyer) pair: the listing features, the buyer's
+    preferences and the model/prompt version. Any change to one of them is a
+    different key, so stale scores are never returned.
+    """
+    return f"{_digest(version)[:16]}:{_digest(listing_features(listing))}:{_digest(buyer_features(buyer))}"
+
+
+class ScoreCache:
+    """
+    LRU cache of relevance scores with a TTL. When `path` is set, entries are
+    also written to a SQLite file so they survive restarts.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS relevance_scores (key TEXT PRIMARY KEY, score INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM relevance_scores WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.environ.get("SCORE_CACHE_SIZE", DEFAULT_MAX_ENTRIES)),
+            ttl=float(os.environ.get("SCORE_CACHE_TTL", DEFAULT_TTL)),
+            path=os.environ.get("SCORE_CACHE_PATH") or None,
+        )
+
+    def _remember(self, key, score, expires_at):
+        self._entries[key] = (score, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key) -> Optional[int]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT score, expires_at FROM relevance_scores WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = row
+                    self._remember(key, *row)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set_many(self, items: dict):
+        """Stores {key: score} entries."""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            for key, score in items.items():
+                self._remember(key, score, expires_at)
+            if self._db is not None and items:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO relevance_scores (key, score, expires_at) VALUES (?, ?, ?)",
+                    [(key, score, expires_at) for key, score in items.items()],
+                )
+                self._db.commit()
+
+    def set(self, key, score: int):
+        self.set_many({key: score})
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+@lru_cache(maxsize=None)
+def get_score_cache() -> ScoreCache:
+    load_env()
+    return ScoreCache.from_env()
@@ -0,0 +1,330 @@
+"""
+In-memory full-text search over listings for GET /search.
+
+An inverted index maps each term of a listing's title, description and
+location to the listings containing it; queries are ranked with BM25 and
+can be limited to a price range. The index is built at startup from one
+paginated pass over the listings table and kept current through
+supabase_functions.on_change as listings are written and deleted.
+
+Postings are kept in dicts so updates are cheap, and each term's postings
+are compiled to NumPy arrays, so a query scores every matching listing with
+a few vectorized operations. After a write, a term's compiled arrays are
+patched for just the listings that changed instead of being rebuilt.
+
+When there is no change feed to carry other workers' writes,
+SEARCH_INDEX_REBUILD_INTERVAL rebuilds the index every that many seconds.
+"""
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+from clients import load_env
+from listing_features import LISTING_LIST_COLUMNS, singular
+from supabase_functions import iter_pages
+
+# BM25 term-frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+
+# Title terms count this many times, so a match in the title ranks higher
+TITLE_WEIGHT = 2
+
+DEFAULT_PAGE_SIZE = 1000
+
+# Past this share of a term's postings changing, recompiling beats patching
+PATCH_LIMIT = 0.25
+
+# Fields kept per listing and returned in search results
+RESULT_FIELDS = [column.strip() for column in LISTING_LIST_COLUMNS.split(",")]
+
+STOPWORDS = {"a", "an", "and", "for", "in", "of", "on", "or", "the", "to", "with"}
+
+
+# Listing text repeats the same words, so their singular forms are memoized
+_singular = lru_cache(maxsize=65536)(singular)
+
+
+def tokenize(text) -> list[str]:
+    """Lowercase, singular terms of a text, without stopwords"""
+    return [
+        _singular(word)
+        for word in re.findall(r"[a-z0-9]+", str(text or "").lower())
+        if word not in STOPWORDS
+    ]
+
+
+def _price(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Listings live in numbered slots; freed slots are reused
+        self._slots = {}
+        self._docs = []
+        self._terms = []
+        self._free = []
+        self._lengths = np.zeros(16, dtype=np.float32)
+        self._prices = np.full(16, np.nan)
+        self._alive = np.zeros(16, dtype=bool)
+        self._total_length = 0.0
+        # term -> {slot: weighted term frequency}
+        self._postings = {}
+        # term -> (slots, frequencies) arrays, patched after the term changes
+        self._compiled = {}
+        # term -> slots changed since the term was compiled
+        self._changed = {}
+        self._building = False
+        self._removed_while_building = set()
+        self._seen_while_building = set()
+        self.ready = False
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _grow(self, size):
+        capacity = len(self._lengths)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        lengths = np.zeros(capacity, dtype=np.float32)
+        lengths[: len(self._lengths)] = self._lengths
+        prices = np.full(capacity, np.nan)
+        prices[: len(self._prices)] = self._prices
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: len(self._alive)] = self._alive
+        self._lengths, self._prices, self._alive = lengths, prices, alive
+
+    def _unindex(self, slot):
+        for term in self._terms[slot]:
+            postings = self._postings[term]
+            del postings[slot]
+            if postings:
+                self._mark_changed(term, slot)
+            else:
+                del self._postings[term]
+                self._compiled.pop(term, None)
+                self._changed.pop(term, None)
+        self._total_length -= float(self._lengths[slot])
+        self._lengths[slot] = 0
+        self._prices[slot] = np.nan
+        self._terms[slot] = Counter()
+
+    def _mark_changed(self, term, slot):
+        if term in self._compiled:
+            self._changed.setdefault(term, set()).add(slot)
+
+    def upsert(self, listings, from_build=False):
+        """Adds or replaces listings (dicts with at least an id)"""
+        with self._lock:
+            for listing in listings:
+                listing_id = listing["id"]
+                if from_build and listing_id in self._removed_while_building:
+                    continue
+                if self._building:
+                    self._seen_while_building.add(listing_id)
+                terms = Counter(tokenize(listing.get("description")) + tokenize(listing.get("location")))
+                for term in tokenize(listing.get("title")):
+                    terms[term] += TITLE_WEIGHT
+
+                slot = self._slots.get(listing_id)
+                if slot is None:
+                    if self._free:
+                        slot = self._free.pop()
+                    else:
+                        slot = len(self._docs)
+                        self._docs.append(None)
+                        self._terms.append(Counter())
+                        self._grow(slot + 1)
+                    self._slots[listing_id] = slot
+                else:
+                    self._unindex(slot)
+
+                self._docs[slot] = {field: listing.get(field) for field in RESULT_FIELDS if field in listing}
+                self._terms[slot] = terms
+                length = sum(terms.values())
+                self._lengths[slot] = length
+                self._total_length += length
+                self._prices[slot] = _price(listing.get("price"))
+                self._alive[slot] = True
+                for term, frequency in terms.items():
+                    self._postings.setdefault(term, {})[slot] = frequency
+                    self._mark_changed(term, slot)
+
+    def _remove(self, listing_id):
+        slot = self._slots.pop(listing_id, None)
+        if slot is None:
+            return
+        self._unindex(slot)
+        self._docs[slot] = None
+        self._alive[slot] = False
+        self._free.append(slot)
+
+    def remove(self, listing_ids):
+        with self._lock:
+            for listing_id in listing_ids:
+                if self._building:
+                    self._removed_while_building.add(listing_id)
+                self._remove(listing_id)
+
+    def _compile(self, term):
+        compiled = self._compiled.get(term)
+        changed = self._changed.pop(term, None)
+        if compiled is not None and not changed:
+            return compiled
+        postings = self._postings.get(term)
+        if not postings:
+            return None
+        if compiled is not None and len(changed) <= PATCH_LIMIT * len(compiled[0]):
+            # Drop the changed slots' old entries and append their current ones
+            slots, frequencies = compiled
+            keep = ~np.isin(slots, np.fromiter(changed, dtype=np.int64, count=len(changed)))
+            current = [slot for slot in changed if slot in postings]
+            compiled = (
+                np.concatenate([slots[keep], np.array(current, dtype=np.int64)]),
+                np.concatenate([frequencies[keep], np.array([postings[slot] for slot in current], dtype=np.float32)]),
+            )
+        else:
+            compiled = (
+                np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                np.fromiter(postings.values(), dtype=np.float32, count=len(postings)),
+            )
+        self._compiled[term] = compiled
+        return compiled
+
+    def search(self, query="", min_price=None, max_price=None, limit=20) -> dict:
+        """
+        Returns {"data": listings with a "score", best first, "total": matches}.
+        Without query terms, every listing in the price range matches,
+        cheapest first.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            count = len(self._slots)
+            size = len(self._docs)
+            average_length = self._total_length / count if count else 0.0
+            compiled = [self._compile(term) for term in terms]
+            lengths = self._lengths[:size]
+            prices = self._prices[:size]
+
+            if terms:
+                scores = np.zeros(size, dtype=np.float32)
+                for postings in compiled:
+                    if postings is None:
+                        continue
+                    slots, frequencies = postings
+                    idf = math.log(1 + (count - len(slots) + 0.5) / (len(slots) + 0.5))
+                    norm = K1 * (1 - B + B * lengths[slots] / max(average_length, 1e-9))
+                    scores[slots] += idf * frequencies * (K1 + 1) / (frequencies + norm)
+                matched = np.flatnonzero(scores > 0)
+            else:
+                matched = np.flatnonzero(self._alive[:size])
+
+            # NaN prices (unpriced listings) fail any price bound
+            if min_price is not None:
+                matched = matched[prices[matched] >= min_price]
+            if max_price is not None:
+                matched = matched[prices[matched] <= max_price]
+
+            if terms:
+                ranking = -scores[matched]
+            else:
+                scores = None
+                ranking = np.nan_to_num(prices[matched], nan=np.inf)
+            if len(matched) > limit:
+                top = np.argpartition(ranking, limit - 1)[:limit]
+                top = top[np.argsort(ranking[top], kind="stable")]
+            else:
+                top = np.argsort(ranking, kind="stable")
+
+            results = [
+                {**self._docs[slot], "score": float(scores[slot]) if scores is not None else None}
+                for slot in matched[top]
+            ]
+        return {"data": results, "total": int(len(matched))}
+
+    def build(self, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Indexes the listings table one page at a time, then drops listings
+        that are no longer in it and were not written during the build
+        """
+        with self._lock:
+            self._building = True
+            self._removed_while_building.clear()
+            self._seen_while_building.clear()
+        try:
+            for page in iter_pages("listings", LISTING_LIST_COLUMNS, page_size=page_size, cached=False):
+                self.upsert(page, from_build=True)
+            with self._lock:
+                for listing_id in [i for i in self._slots if i not in self._seen_while_building]:
+                    self._remove(listing_id)
+            self.ready = True
+            print(f"Search index built with {len(self)} listings")
+        finally:
+            with self._lock:
+                self._building = False
+                self._removed_while_building.clear()
+                self._seen_while_building.clear()
+
+    def build_in_background(self, page_size=DEFAULT_PAGE_SIZE):
+        def run():
+            try:
+                self.build(page_size)
+            except Exception as e:
+                print(f"Error building search index: {str(e)}")
+
+        thread = threading.Thread(target=run, name="search-index", daemon=True)
+        thread.start()
+        return thread
+
+    def rebuild_periodically(self, interval, page_size=DEFAULT_PAGE_SIZE):
+        """Rebuilds the index every `interval` seconds in a background thread"""
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.build(page_size)
+                except Exception as e:
+                    print(f"Error rebuilding search index: {str(e)}")
+
+        thread = threading.Thread(target=run, name="search-index-rebuild", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"listings": len(self._slots), "terms": len(self._postings), "ready": int(self.ready)}
+
+
+def get_search_page_size() -> int:
+    return int(os.environ.get("SEARCH_INDEX_PAGE_SIZE", DEFAULT_PAGE_SIZE))
+
+
+def get_search_rebuild_interval() -> float:
+    return float(os.environ.get("SEARCH_INDEX_REBUILD_INTERVAL", 0))
+
+
+@lru_cache(maxsize=None)
+def get_search_index() -> SearchIndex:
+    load_env()
+    return SearchIndex()
+
+
+def update_search_index(event, rows):
+    """Keeps the search index in step with listing writes and deletes"""
+    if event in ("INSERT", "UPDATE"):
+        get_search_index().upsert(rows)
+    elif event == "DELETE":
+        get_search_index().remove([row["id"] for row in rows])
@@ -0,0 +1,102 @@
+import hashlib
+import threading
+
+import stripe
+from metrics import span
+
+
+def _idempotency_key(*parts) -> str:
+    fingerprint = ":".join(str(part) for part in parts)
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:40]
+
+
+class PriceIndex:
+    """
+    Local index of (product_id, unit_amount, currency) -> Stripe Price and of
+    price id -> payment link URL, so a price that already exists in Stripe is
+    reused instead of created again. Creation calls carry deterministic
+    idempotency keys so a retried request cannot create duplicates.
+    """
+
+    def __init__(self):
+        self._prices = {}
+        self._links = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def remember(self, price, payment_link_url=None):
+        with self._lock:
+            self._prices[(price.product, price.unit_amount, price.currency)] = price
+            if payment_link_url:
+                self._links[price.id] = payment_link_url
+
+    def lookup(self, product_id, unit_amount, currency="usd"):
+        """Returns (price, payment_link_url or None), or None if unknown"""
+        with self._lock:
+            price = self._prices.get((product_id, unit_amount, currency))
+            if price is None:
+                return None
+            return price, self._links.get(price.id)
+
+    def warm(self):
+        """Loads active prices and payment links from Stripe"""
+        try:
+            for price in stripe.Price.list(active=True, limit=100).auto_paging_iter():
+                if price.unit_amount is not None:
+                    self.remember(price)
+            # Line items come expanded in the same pages, not one call per link
+            links = stripe.PaymentLink.list(active=True, limit=100, expand=["data.line_items"])
+            for link in links.auto_paging_iter():
+                line_items = link.line_items
+                # Only single-item links can be reused for a single price
+                if line_items and len(line_items.data) == 1 and not line_items.has_more:
+                    price = line_items.data[0].price
+                    if price.unit_amount is not None:
+                        self.remember(price, link.url)
+            print(f"Warmed Stripe price index with {len(self._prices)} prices and {len(self._links)} payment links")
+        except Exception as e:
+            print(f"Failed to warm Stripe price index: {str(e)}")
+
+    def warm_in_background(self):
+        threading.Thread(target=self.warm, name="stripe-price-warmup", daemon=True).start()
+
+    def get_or_create(self, product_id, unit_amount, currency="usd"):
+        """
+        Returns (price, payment_link_url) for the product at this amount,
+        where price is the Stripe Price, creating the price and/or payment
+        link in Stripe only when missing.
+        """
+        cached = self.lookup(product_id, unit_amount, currency)
+        price, payment_link_url = cached if cached else (None, None)
+
+        if price is None:
+            with span("stripe.price_create"):
+                price = stripe.Price.create(
+                    product=product_id,
+                    unit_amount=unit_amount,
+                    currency=currency,
+                    idempotency_key=_idempotency_key("price", product_id, unit_amount, currency),
+                )
+
+        if payment_link_url is None:
+            with span("stripe.payment_link_create"):
+                payment_link = stripe.PaymentLink.create(
+                    line_items=[{
+                        "price": price.id,
+                        "quantity": 1
+                    }],
+                    idempotency_key=_idempotency_key("payment-link", price.id),
+                )
+            payment_link_url = payment_link.url
+
+        with self._lock:
+            if cached and cached[1]:
+                self.hits += 1
+            else:
+                self.misses += 1
+        self.remember(price, payment_link_url)
+        return price, payment_link_url
+
+
+price_index = PriceIndex()
@@ -1,22 +1,268 @@
+"""
+Supabase table helpers.
+
+Reads made through these helpers are served from an in-process read-through
+cache (TableCache) with a TTL per table. Writes made through them drop the
+cached reads of the table they touched and are passed, with their rows, to
+the on_change listeners (the vector and search indexes). With
+SUPABASE_CHANGE_FEED=realtime, the Supabase Realtime change feed does the
+same for writes made by other workers or processes. The feed also echoes a
+worker's own writes, so listeners must tolerate seeing a row twice.
+"""
+import asyncio
 import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+from functools import lru_cache
+
+from clients import get_supabase, load_env
+from metrics import span
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 30.0
+DEFAULT_FEED_TABLES = "listings,users"
+
+# Marks this process's own events on a shared feed, so they are not applied twice
+_ORIGIN = uuid.uuid4().hex
+
+
+def get_supabase_client():
+    # The client is created on first use and shared by the whole process
+    return get_supabase()
+
+# Callbacks run after rows are written through this module, keyed by table
+_change_listeners = defaultdict(list)
+
+
+def on_change(table_name, callback):
+    """Registers callback(event, rows) for INSERT, UPDATE and DELETE events on a table"""
+    _change_listeners[table_name].append(callback)
+
+
+class TableCache:
+    """
+    Bounded LRU cache of query results, keyed by (table, query). Entries
+    expire after the table's TTL, and invalidate(table) drops every entry
+    of a table. Concurrent misses for the same query share one fetch.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE, default_ttl=DEFAULT_CACHE_TTL, ttls=None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        # Bumped on invalidation, so a fetch that raced a write is not stored
+        self._generations = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        # SUPABASE_CACHE_TTLS overrides the default per table, e.g. listings=10,users=60
+        ttls = {}
+        for pair in os.environ.get("SUPABASE_CACHE_TTLS", "").split(","):
+            table_name, _, ttl = pair.partition("=")
+            if table_name.strip() and ttl.strip():
+                ttls[table_name.strip()] = float(ttl)
+        return cls(
+            max_entries=int(os.environ.get("SUPABASE_CACHE_SIZE", DEFAULT_CACHE_SIZE)),
+            default_ttl=float(os.environ.get("SUPABASE_CACHE_TTL", DEFAULT_CACHE_TTL)),
+            ttls=ttls,
+        )
 
-# Load environment variables from .env file
-load_dotenv(dotenv_path=".env")
+    def ttl(self, table_name) -> float:
+        return self.ttls.get(table_name, self.default_ttl)
 
+    def get_or_fetch(self, table_name, query_key, fetch) -> list:
+        """Returns the cached rows for the query, or fetch() and caches its result"""
+        ttl = self.ttl(table_name)
+        if ttl <= 0 or self.max_entries <= 0:
+            return fetch()
+        key = (table_name, query_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] >= time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy_rows(entry[0])
+            self.misses += 1
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+                generation = self._generations[table_name]
 
-def get_supabase_client() -> Client:
-    url = os.environ.get("SUPABASE_URL")
-    key = os.environ.get("SUPABASE_KEY")
-    print(f"util URL: {url}")
-    print(f"util KEY: {key}")
-    supabase: Client = create_client(url, key)
-    return supabase
+        if not owner:
+            return _copy_rows(future.result())
+        try:
+            rows = fetch()
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if self._generations[table_name] == generation:
+                self._entries[key] = (rows, time.time() + ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(rows)
+        return _copy_rows(rows)
 
+    def invalidate(self, table_name):
+        with self._lock:
+            self._generations[table_name] += 1
+            self.invalidations += 1
+            for key in [key for key in self._entries if key[0] == table_name]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+            }
+
+
+def _copy_rows(rows):
+    # Callers get their own row dicts, so changing one cannot change the cache
+    if isinstance(rows, list):
+        return [dict(row) if isinstance(row, dict) else row for row in rows]
+    return rows
+
+
+class LocalChangeFeed:
+    """
+    In-process stand-in for the Supabase Realtime feed: publish() delivers
+    the event straight to every subscriber, such as the caches and indexes
+    of simulated workers in a test.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback, origin=None):
+        """
+        Registers callback(table_name, event, rows). Events published with
+        the subscriber's own origin are not delivered back to it.
+        """
+        self._subscribers.append((callback, origin))
+
+    def publish(self, table_name, event, rows, origin=None):
+        for callback, subscriber_origin in list(self._subscribers):
+            if origin is not None and origin == subscriber_origin:
+                continue
+            try:
+                callback(table_name, event, rows)
+            except Exception as e:
+                print(f"Change feed subscriber failed for {table_name}: {str(e)}")
+
+    def start(self):
+        pass
+
+
+class SupabaseChangeFeed(LocalChangeFeed):
+    """
+    Postgres change events for the given tables from Supabase Realtime. The
+    realtime client is async only, so it runs on its own event loop in a
+    background thread. Writes are announced by the database itself, so
+    publish() only delivers to local subscribers.
+    """
 
-# Initialize the Supabase client
-supabase: Client = get_supabase_client()
+    def _deliver(self, table_name, payload):
+        data = payload.get("data") or payload
+        event = data.get("type") or data.get("eventType") or "*"
+        # Deletes carry the old row (at least its primary key)
+        row = data.get("old_record") if event == "DELETE" else data.get("record")
+        self.publish(table_name, event, [row] if row else [])
+
+    def __init__(self, url, key, tables):
+        super().__init__()
+        self.url = url
+        self.key = key
+        self.tables = tables
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=lambda: asyncio.run(self._listen()), name="supabase-changes", daemon=True)
+            self._thread.start()
+
+    async def _listen(self):
+        from realtime import AsyncRealtimeClient
+
+        try:
+            client = AsyncRealtimeClient(f"{self.url}/realtime/v1", self.key)
+            await client.connect()
+            channel = client.channel("table-cache")
+            for table_name in self.tables:
+                channel.on_postgres_changes(
+                    "*",
+                    table=table_name,
+                    callback=lambda payload, table_name=table_name: self._deliver(table_name, payload),
+                )
+            await channel.subscribe()
+            print(f"Listening for Supabase changes to {', '.join(self.tables)}")
+            # The client reads and reconnects in its own tasks
+            await asyncio.Event().wait()
+        except Exception as e:
+            print(f"Supabase change feed stopped, other workers' writes are only seen after cache TTLs: {str(e)}")
+
+
+@lru_cache(maxsize=None)
+def get_table_cache() -> TableCache:
+    load_env()
+    return TableCache.from_env()
+
+
+@lru_cache(maxsize=None)
+def get_change_feed():
+    """The feed named by SUPABASE_CHANGE_FEED (none, local or realtime), started and wired to the cache and listeners"""
+    load_env()
+    kind = os.environ.get("SUPABASE_CHANGE_FEED", "none")
+    if kind == "none":
+        return None
+    if kind == "local":
+        feed = LocalChangeFeed()
+    elif kind == "realtime":
+        tables = os.environ.get("SUPABASE_CHANGE_FEED_TABLES", DEFAULT_FEED_TABLES)
+        feed = SupabaseChangeFeed(
+            os.environ.get("SUPABASE_URL"),
+            os.environ.get("SUPABASE_KEY"),
+            [table_name.strip() for table_name in tables.split(",") if table_name.strip()],
+        )
+    else:
+        raise ValueError(f"Unknown SUPABASE_CHANGE_FEED: {kind}")
+    feed.subscribe(_apply_change, origin=_ORIGIN)
+    feed.start()
+    return feed
+
+
+def _apply_change(table_name, event, rows):
+    """Drops the table's cached reads and runs its listeners, for local and feed events alike"""
+    get_table_cache().invalidate(table_name)
+    for callback in _change_listeners[table_name]:
+        try:
+            callback(event, rows)
+        except Exception as e:
+            print(f"Change listener failed for {table_name}: {str(e)}")
+
+
+def _notify_change(table_name, event, rows):
+    _apply_change(table_name, event, rows)
+    feed = get_change_feed()
+    if feed is not None:
+        feed.publish(table_name, event, rows, origin=_ORIGIN)
 
 
 def get_table_schema(table_name):
@@ -25,7 +271,7 @@ def get_table_schema(table_name):
     FROM information_schema.columns
     WHERE table_name = '{table_name}';
     """
-    response = supabase.rpc("sql", {"query": query})
+    response = get_supabase().rpc("sql", {"query": query})
     return response.data
 
 
@@ -42,26 +288,81 @@ def document_schema(schema_data, table_name):
     return "\n".join(doc_lines)
 
 
-def insert_to_supabase(table_name, data: dict):
-    response = supabase.table(table_name).insert(data).execute()
+def insert_to_supabase(table_name, data):
+    """Insert one row (dict) or many rows (list of dicts) in a single request"""
+    with span("supabase.insert", table=table_name):
+        response = get_supabase().table(table_name).insert(data).execute()
+    _notify_change(table_name, "INSERT", response.data)
+    return response
+
+
+def upsert_to_supabase(table_name, rows: list, on_conflict: str):
+    """Insert or update many rows in a single request"""
+    with span("supabase.upsert", table=table_name):
+        response = get_supabase().table(table_name).upsert(rows, on_conflict=on_conflict).execute()
+    _notify_change(table_name, "UPDATE", response.data)
     return response
 
 
 def select_all_from_supabase(table_name):
     """Select all data from a table"""
-    response = supabase.table(table_name).select("*").execute()
-    return response.data
+    return select_rows(table_name)
+
+
+def select_rows(table_name, columns="*", **filters):
+    """Select the rows where each column equals the given value, through the cache"""
+
+    def fetch():
+        query = get_supabase().table(table_name).select(columns)
+        for column_name, value in filters.items():
+            query = query.eq(column_name, value)
+        with span("supabase.select", table=table_name):
+            return query.execute().data
+
+    query_key = ("rows", columns, tuple(sorted((column, str(value)) for column, value in filters.items())))
+    return get_table_cache().get_or_fetch(table_name, query_key, fetch)
+
+
+def select_page(table_name, columns="*", limit=100, after=None, query=None, cached=True):
+    """
+    Select one page of rows ordered by id, starting after the given id.
+    Pages of a custom `query` are never cached.
+    """
+
+    def fetch():
+        page_query = query or get_supabase().table(table_name).select(columns)
+        if after is not None:
+            page_query = page_query.gt("id", after)
+        with span("supabase.select", table=table_name):
+            return page_query.order("id").limit(limit).execute().data
+
+    if query is not None or not cached:
+        return fetch()
+    return get_table_cache().get_or_fetch(table_name, ("page", columns, limit, after), fetch)
+
+
+def iter_pages(table_name, columns="*", page_size=500, cached=True, after=None):
+    """Yield pages of rows ordered by id, starting after the given id, until the table is exhausted"""
+    while True:
+        page = select_page(table_name, columns, page_size, after, cached=cached)
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        after = page[-1]["id"]
 
 
 def filter_from_supabase(table_name, column_name, value):
     """Select data from Supabase"""
-    response = supabase.table(table_name).select("*").eq(column_name, value).execute()
-    return response.data
+    return select_rows(table_name, "*", **{column_name: value})
 
 
 def delete_from_supabase(table_name, column_name, value):
     """Delete data from Supabase"""
-    response = supabase.table(table_name).delete().eq(column_name, value).execute()
+    with span("supabase.delete", table=table_name):
+        response = get_supabase().table(table_name).delete().eq(column_name, value).execute()
+    _notify_change(table_name, "DELETE", response.data)
     return response
 
 
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+
+DEFAULT_MAX_UPLOAD_MB = 20
+
+# Raw uploads bigger than this are spooled to disk while they arrive
+SPOOL_THRESHOLD = 1024 * 1024
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """The request did not contain a usable image upload"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def get_max_upload_bytes() -> int:
+    return int(float(os.environ.get("MAX_UPLOAD_MB", DEFAULT_MAX_UPLOAD_MB)) * 1024 * 1024)
+
+
+def get_max_bulk_upload_bytes(max_items) -> int:
+    """Largest bulk request body: one full-size upload per allowed image"""
+    return get_max_upload_bytes() * max_items
+
+
+def _read_stream(stream, length=None) -> memoryview:
+    """Reads a request body without building intermediate copies"""
+    if length is not None:
+        # Known size: fill one preallocated buffer in place
+        buffer = bytearray(length)
+        view = memoryview(buffer)
+        read = 0
+        while read < length:
+            count = stream.readinto(view[read:]) if hasattr(stream, "readinto") else None
+            if count is None:
+                chunk = stream.read(length - read)
+                count = len(chunk)
+                view[read : read + count] = chunk
+            if not count:
+                break
+            read += count
+        return view[:read]
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_THRESHOLD) as spool:
+        shutil.copyfileobj(stream, spool, CHUNK_SIZE)
+        size = spool.tell()
+        spool.seek(0)
+        return _read_stream(spool, size)
+
+
+def _read_file(upload) -> memoryview:
+    # Werkzeug has already spooled large multipart parts to a temp file
+    upload.stream.seek(0, os.SEEK_END)
+    size = upload.stream.tell()
+    upload.stream.seek(0)
+    return _read_stream(upload.stream, size)
+
+
+def read_image_upload(request):
+    """
+    Returns the uploaded image from a request as raw bytes (a memoryview) for
+    multipart/form-data ("image" field) and application/octet-stream or
+    image/* bodies, or as the base64 string of a JSON `base64_image` field.
+    """
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("image")
+        if upload is None:
+            raise UploadError("image file is required")
+        return _read_file(upload)
+
+    if request.mimetype == "application/octet-stream" or request.mimetype.startswith("image/"):
+        data = _read_stream(request.stream, request.content_length)
+        if not data:
+            raise UploadError("Request body is empty")
+        return data
+
+    if not request.is_json:
+        raise UploadError("Request must be JSON, multipart/form-data or application/octet-stream")
+
+    data = request.get_json()
+
+    # Check if base64_image is in the request
+    if not isinstance(data, dict) or "base64_image" not in data:
+        raise UploadError("base64_image is required")
+    return data["base64_image"]
+
+
+def read_image_uploads(request) -> list:
+    """Like read_image_upload, for many "images" files or a JSON `base64_images` list"""
+    if request.mimetype == "multipart/form-data":
+        uploads = request.files.getlist("images")
+        if not uploads:
+            raise UploadError("images files are required")
+        return [_read_file(upload) for upload in uploads]
+
+    if not request.is_json:
+        raise UploadError("Request must be JSON or multipart/form-data")
+
+    data = request.get_json()
+    if not isinstance(data, dict):
+        raise UploadError("Request body must be a JSON object")
+
+    base64_images = data.get("base64_images")
+    if not isinstance(base64_images, list) or not base64_images:
+        raise UploadError("base64_images must be a non-empty list")
+    return base64_images
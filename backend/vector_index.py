@@ -0,0 +1,246 @@
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from listing_features import buyer_features, listing_features
+from metrics import count, span
+from openai_scheduler import BULK, get_scheduler
+from clients import get_openai, load_env
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Buyers kept per listing after the embedding pre-filter, 0 disables it
+DEFAULT_PREFILTER_TOP_K = 50
+
+# Index updates from writes are embedded here, in order, off the write path
+_updates = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vector-index")
+
+
+class OpenAIEmbedder:
+    """Embeds texts with the OpenAI embeddings endpoint."""
+
+    def __init__(self, model=EMBEDDING_MODEL):
+        self.model = model
+
+    def embed(self, texts) -> np.ndarray:
+        texts = list(texts)
+        with span("openai.embeddings"):
+            response = get_scheduler().run(
+                lambda: get_openai().embeddings.create(model=self.model, input=texts),
+                priority=BULK,
+                tokens=sum(len(text) for text in texts) // 4 + 1,
+            )
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+
+class HashingEmbedder:
+    """
+    Deterministic offline embedder that hashes each token into a fixed number
+    of signed buckets. Texts sharing words end up with similar vectors, which
+    is enough to exercise the index without network access.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, texts) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in re.findall(r"\w+", str(text).lower()):
+                digest = hashlib.sha1(token.encode("utf-8")).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        return vectors
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class VectorIndex:
+    """
+    In-process cosine-similarity index over unit vectors stored in one NumPy
+    matrix. Items are upserted and removed incrementally; an item is only
+    re-embedded when its text changes.
+    """
+
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._ids = []
+        self._positions = {}
+        self._fingerprints = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, item_id):
+        return item_id in self._positions
+
+    def upsert(self, items: dict) -> int:
+        """Adds or updates {id: text} items and returns how many were embedded."""
+        with self._lock:
+            changed = {
+                item_id: text
+                for item_id, text in items.items()
+                if self._fingerprints.get(item_id) != _fingerprint(text)
+            }
+        if not changed:
+            return 0
+
+        vectors = _normalize(self.embedder.embed(list(changed.values())))
+
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((max(16, len(changed)), vectors.shape[1]), dtype=np.float32)
+            for (item_id, text), vector in zip(changed.items(), vectors):
+                position = self._positions.get(item_id)
+                if position is None:
+                    position = len(self._ids)
+                    if position == len(self._matrix):
+                        grown = np.zeros((len(self._matrix) * 2, self._matrix.shape[1]), dtype=np.float32)
+                        grown[:position] = self._matrix
+                        self._matrix = grown
+                    self._ids.append(item_id)
+                    self._positions[item_id] = position
+                self._matrix[position] = vector
+                self._fingerprints[item_id] = _fingerprint(text)
+        return len(changed)
+
+    def remove(self, item_ids):
+        with self._lock:
+            for item_id in item_ids:
+                position = self._positions.pop(item_id, None)
+                if position is None:
+                    continue
+                self._fingerprints.pop(item_id, None)
+                # Move the last row into the freed slot to keep the matrix dense
+                last = len(self._ids) - 1
+                if position != last:
+                    moved_id = self._ids[last]
+                    self._matrix[position] = self._matrix[last]
+                    self._ids[position] = moved_id
+                    self._positions[moved_id] = position
+                self._ids.pop()
+
+    def vectors(self, item_ids) -> np.ndarray:
+        with self._lock:
+            return self._matrix[[self._positions[item_id] for item_id in item_ids]].copy()
+
+    def search(self, queries: np.ndarray, k: int, candidate_ids=None):
+        """
+        Returns the k most similar items for each query vector as lists of
+        (id, score), optionally restricted to `candidate_ids`.
+        """
+        with self._lock:
+            if not self._ids:
+                return [[] for _ in range(len(queries))]
+            if candidate_ids is None:
+                positions = np.arange(len(self._ids))
+            else:
+                positions = np.array(
+                    [self._positions[item_id] for item_id in candidate_ids if item_id in self._positions],
+                    dtype=np.int64,
+                )
+            ids = [self._ids[position] for position in positions]
+            matrix = self._matrix[positions]
+
+        if len(ids) == 0 or k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        similarities = _normalize(np.atleast_2d(queries).astype(np.float32)) @ matrix.T
+        k = min(k, len(ids))
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        results = []
+        for row, columns in zip(similarities, top):
+            ordered = columns[np.argsort(-row[columns])]
+            results.append([(ids[column], float(row[column])) for column in ordered])
+        return results
+
+
+def get_embedder():
+    if os.environ.get("EMBEDDER", "openai") == "hashing":
+        return HashingEmbedder()
+    return OpenAIEmbedder()
+
+
+def get_prefilter_top_k() -> int:
+    return int(os.environ.get("PREFILTER_TOP_K", DEFAULT_PREFILTER_TOP_K))
+
+
+@lru_cache(maxsize=None)
+def get_listing_index() -> VectorIndex:
+    load_env()
+    return VectorIndex(get_embedder())
+
+
+@lru_cache(maxsize=None)
+def get_buyer_index() -> VectorIndex:
+    load_env()
+    return VectorIndex(get_embedder())
+
+
+def _apply_change(name, index, event, items):
+    try:
+        if event in ("INSERT", "UPDATE"):
+            index.upsert(items)
+        elif event == "DELETE":
+            index.remove(items)
+    except Exception as e:
+        # candidate_pairs embeds whatever is missing, so the index catches up there
+        count("vector_index_update_errors_total", index=name)
+        print(f"Error updating the {name} index: {str(e)}")
+
+
+def on_listings_change(event, rows):
+    """Queues the listing index update for a write or delete; never blocks the writer."""
+    if event in ("INSERT", "UPDATE"):
+        items = {row["id"]: listing_features(row) for row in rows}
+    else:
+        items = [row["id"] for row in rows]
+    _updates.submit(_apply_change, "listing", get_listing_index(), event, items)
+
+
+def on_users_change(event, rows):
+    """Queues the buyer index update for a write or delete; never blocks the writer."""
+    if event in ("INSERT", "UPDATE"):
+        items = {row["id"]: buyer_features(row) for row in rows}
+    else:
+        items = [row["id"] for row in rows]
+    _updates.submit(_apply_change, "buyer", get_buyer_index(), event, items)
+
+
+def candidate_pairs(listings, buyers, k=None):
+    """
+    Picks the k buyers whose preferences are closest to each listing, so only
+    those pairs need an LLM relevance score.
+    """
+    k = get_prefilter_top_k() if k is None else k
+    if k <= 0 or len(buyers) <= k:
+        return [(listing, buyer) for listing in listings for buyer in buyers]
+
+    get_listing_index().upsert({listing["id"]: listing_features(listing) for listing in listings})
+    get_buyer_index().upsert({buyer["id"]: buyer_features(buyer) for buyer in buyers})
+
+    buyers_by_id = {buyer["id"]: buyer for buyer in buyers}
+    matches = get_buyer_index().search(
+        get_listing_index().vectors([listing["id"] for listing in listings]),
+        k,
+        candidate_ids=list(buyers_by_id),
+    )
+    return [
+        (listing, buyers_by_id[buyer_id])
+        for listing, listing_matches in zip(listings, matches)
+        for buyer_id, _ in listing_matches
+    ]
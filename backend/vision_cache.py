@@ -0,0 +1,106 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import lru_cache
+
+from clients import load_env
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def vision_key(data, settings, model: str, prompt: str) -> str:
+    """
+    Cache key for a vision analysis: the uploaded image bytes, the
+    preprocessing settings, the model and the prompt, so changing any of
+    them never returns an old answer. Hashing the upload rather than the
+    prepared image lets a hit skip preprocessing.
+    """
+    digest = hashlib.sha256()
+    for part in (model, prompt, *(str(setting) for setting in settings)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class VisionCache:
+    """
+    LRU cache with a TTL for vision results. Concurrent lookups of the same
+    key while it is being computed wait for that one call instead of making
+    their own (single-flight).
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.environ.get("VISION_CACHE_SIZE", DEFAULT_MAX_ENTRIES)),
+            ttl=float(os.environ.get("VISION_CACHE_TTL", DEFAULT_TTL)),
+        )
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for key, calling compute() at most once for concurrent misses"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] >= time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+        # Failed analyses come back as None and are retried next time
+        if value is not None:
+            with self._lock:
+                self._entries[key] = (value, time.time() + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "size": len(self._entries),
+            }
+
+
+@lru_cache(maxsize=None)
+def get_vision_cache() -> VisionCache:
+    load_env()
+    return VisionCache.from_env()